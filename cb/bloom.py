@@ -0,0 +1,68 @@
+import hashlib
+import math
+import struct
+from typing import Iterable
+
+import numpy as np
+
+
+# serialized filters start with the number of hash functions and the number of bits
+HEADER = struct.Struct("<II")
+
+
+class BloomFilter:
+    """
+    A Bloom filter over strings. might_contain never gives a false negative and gives a false positive at about the rate
+    the filter was sized for.
+
+    Bit positions are derived from one blake2b digest per value with double hashing so a value is only hashed once
+    however many hash functions the filter uses.
+    """
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: np.ndarray = None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else np.zeros((num_bits + 7) // 8, dtype=np.uint8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, false_positive_rate: float) -> "BloomFilter":
+        capacity = max(capacity, 1)
+        num_bits = max(64, math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    @classmethod
+    def from_values(cls, values: Iterable[str], false_positive_rate: float) -> "BloomFilter":
+        values = set(values)
+        bloom = cls.for_capacity(len(values), false_positive_rate)
+        for value in values:
+            bloom.add(value)
+        return bloom
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BloomFilter":
+        num_hashes, num_bits = HEADER.unpack_from(data)
+        return cls(num_bits, num_hashes, np.frombuffer(data, dtype=np.uint8, offset=HEADER.size))
+
+    def to_bytes(self) -> bytes:
+        return HEADER.pack(self.num_hashes, self.num_bits) + self.bits.tobytes()
+
+    def locate(self, value: str) -> (np.ndarray, np.ndarray):
+        """
+        Return the byte index and bit mask of every bit of a value
+        """
+        h1, h2 = struct.unpack("<QQ", hashlib.blake2b(value.encode(), digest_size=16).digest())
+        # uint64 arithmetic wraps around which is fine for hashing
+        positions = (np.uint64(h1) + np.arange(self.num_hashes, dtype=np.uint64) * np.uint64(h2 | 1)) % np.uint64(self.num_bits)
+        return (positions >> np.uint64(3)).astype(np.int64), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+
+    def add(self, value: str):
+        indices, masks = self.locate(value)
+        np.bitwise_or.at(self.bits, indices, masks)
+
+    def might_contain(self, value: str) -> bool:
+        indices, masks = self.locate(value)
+        return bool(np.all(self.bits[indices] & masks))
+
+    def might_contain_any(self, values: Iterable[str]) -> bool:
+        return any(self.might_contain(v) for v in values)
@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, List, Optional
+
+from django.db import connections
+
+
+def run_tasks(func: Callable, items: Iterable, workers: int = 1, on_done: Optional[Callable[[int], None]] = None) -> List:
+    """
+    Run func over items with up to workers threads and return the results in the order of items.
+
+    on_done is called from the calling thread with the number of finished items every time an item finishes so that
+    progress can be reported while the pool is running. With a single worker the items are run in the calling thread.
+    Database connections opened by a pool thread are closed once its item is done.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    if workers <= 1 or len(items) <= 1:
+        for i, item in enumerate(items):
+            results[i] = func(item)
+            if on_done:
+                on_done(i + 1)
+        return results
+
+    def task(item):
+        try:
+            return func(item)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(task, item): i for i, item in enumerate(items)}
+        for finished, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if on_done:
+                on_done(finished)
+    return results
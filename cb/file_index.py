@@ -0,0 +1,418 @@
+import csv
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import List, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from django.conf import settings
+
+
+# Derived artifacts of a file are stored next to the media files under a directory named after the sha256 hash of the
+# file content so that they are only rebuilt when the content changes.
+FILE_INDEX_FOLDER = "file_index"
+ROW_OFFSETS_FILE = "row_offsets.npy"
+# every column of a tabular file is kept as text in COLUMNS_FILE, the columns where every non empty cell is a number are
+# also kept as float64 in NUMERIC_COLUMNS_FILE. Both are uncompressed Arrow IPC files so they can be memory-mapped.
+COLUMNS_FILE = "columns.arrow"
+NUMERIC_COLUMNS_FILE = "numeric_columns.arrow"
+# column files are written in record batches of at most COLUMN_BATCH_ROWS rows, or of one COLUMN_BLOCK_SIZE block of
+# the file for the Arrow csv reader, so that building them does not load the whole file
+COLUMN_BATCH_ROWS = 65536
+COLUMN_BLOCK_SIZE = 1 << 22
+# file content itself is stored once per sha256 hash under BLOB_FOLDER and shared by every file record with that content
+BLOB_FOLDER = "blobs"
+
+
+def artifact_dir(file_hash: str, create: bool = False) -> str:
+    path = os.path.join(settings.MEDIA_ROOT, FILE_INDEX_FOLDER, file_hash[:2], file_hash)
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def blob_name(file_hash: str) -> str:
+    """
+    Return the storage name of the content-addressed copy of a file, relative to MEDIA_ROOT
+    """
+    return "/".join([BLOB_FOLDER, file_hash[:2], file_hash])
+
+
+def remove_artifacts(file_hash: str):
+    if file_hash:
+        shutil.rmtree(artifact_dir(file_hash), ignore_errors=True)
+
+
+def temp_path(path: str) -> str:
+    """
+    Create an empty file next to path with a name unique to the caller and return its path. Artifacts are written there
+    and moved in place with os.replace so that concurrent builds of the same hash never write to the same file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    return tmp_path
+
+
+def save_array(path: str, array: np.ndarray):
+    tmp_path = temp_path(path)
+    try:
+        # a file object is passed as np.save appends .npy to file names that do not end with it
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_file(tmp_path)
+        raise
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def compute_row_offsets(fileobj, block_size: int = 1 << 20) -> np.ndarray:
+    """
+    Return the byte offset of the start of every line of a binary file object. Element 0 is the header row so the offset
+    of 1-based row n is at index n - 1.
+    """
+    offsets = [np.zeros(1, dtype=np.int64)]
+    position = 0
+    last_byte = b""
+    while True:
+        block = fileobj.read(block_size)
+        if not block:
+            break
+        newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+        offsets.append(newlines.astype(np.int64) + position + 1)
+        position += len(block)
+        last_byte = block[-1:]
+    offsets = np.concatenate(offsets)
+    # a trailing newline does not start another row
+    if last_byte == b"\n" or position == 0:
+        offsets = offsets[:-1]
+    return offsets
+
+
+def save_row_offsets(file_hash: str, offsets: np.ndarray):
+    save_array(os.path.join(artifact_dir(file_hash, create=True), ROW_OFFSETS_FILE), offsets)
+
+
+def load_row_offsets(file_hash: str) -> np.ndarray:
+    """
+    Load the row offsets of a file memory-mapped, returns None if they have not been built yet
+    """
+    path = os.path.join(artifact_dir(file_hash), ROW_OFFSETS_FILE)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r")
+
+
+def vocabulary_path(file_hash: str, column: str) -> str:
+    """
+    Return the path of the sorted distinct identifiers of a column, the column name is hashed to build the file name
+    """
+    return os.path.join(artifact_dir(file_hash), f"identifiers_{hashlib.sha256(column.encode()).hexdigest()[:16]}.npy")
+
+
+def save_vocabulary(file_hash: str, column: str, values) -> np.ndarray:
+    artifact_dir(file_hash, create=True)
+    path = vocabulary_path(file_hash, column)
+    vocabulary = np.array(sorted(set(values)), dtype=str)
+    save_array(path, vocabulary)
+    return vocabulary
+
+
+def load_vocabulary(file_hash: str, column: str) -> Optional[np.ndarray]:
+    """
+    Load the sorted distinct identifiers of a column memory-mapped, returns None if they have not been built yet
+    """
+    path = vocabulary_path(file_hash, column)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r")
+
+
+def prefix_matches(vocabulary: np.ndarray, prefix: str) -> List[str]:
+    """
+    Return the identifiers of a sorted vocabulary that start with prefix using two binary searches
+    """
+    start = np.searchsorted(vocabulary, prefix, side="left")
+    end = np.searchsorted(vocabulary, prefix + "\U0010ffff", side="left")
+    return [str(v) for v in vocabulary[start:end]]
+
+
+def trigrams(value: str) -> set:
+    # padded the same way as pg_trgm so that the start and end of a word weigh more than its middle
+    padded = f"  {value} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def trigram_index(vocabulary: np.ndarray) -> tuple:
+    """
+    Return the number of trigrams of every identifier of a vocabulary and the positions of the identifiers holding each
+    trigram, so that the trigrams of the vocabulary are computed once for all the terms matched against it
+    """
+    sizes = np.empty(len(vocabulary), dtype=np.int32)
+    postings = {}
+    for i, value in enumerate(vocabulary):
+        value_trigrams = trigrams(str(value))
+        sizes[i] = len(value_trigrams)
+        for trigram in value_trigrams:
+            postings.setdefault(trigram, []).append(i)
+    return sizes, {trigram: np.array(positions, dtype=np.int64) for trigram, positions in postings.items()}
+
+
+def fuzzy_matches(vocabulary: np.ndarray, term: str, threshold: float, index: tuple = None) -> List[str]:
+    """
+    Return the identifiers of a vocabulary whose trigram similarity to term is at least threshold. index is the
+    trigram_index of the vocabulary, only the identifiers sharing a trigram with the term are compared.
+    """
+    sizes, postings = index if index is not None else trigram_index(vocabulary)
+    term_trigrams = trigrams(term)
+    shared = np.zeros(len(vocabulary), dtype=np.int32)
+    for trigram in term_trigrams:
+        positions = postings.get(trigram)
+        if positions is not None:
+            shared[positions] += 1
+    candidates = np.flatnonzero(shared)
+    similarity = shared[candidates] / (len(term_trigrams) + sizes[candidates] - shared[candidates])
+    return [str(v) for v in vocabulary[candidates[similarity >= threshold]]]
+
+
+def parse_header(line: bytes, delimiter: str) -> List[str]:
+    return next(csv.reader([line.decode("utf-8", errors="replace").rstrip("\r\n")], delimiter=delimiter, quotechar='"'), [])
+
+
+def unique_column_values(fileobj, delimiter: str, column: str) -> Optional[List[str]]:
+    """
+    Return the distinct non empty cells of a column of a delimited binary file object in the order they first appear,
+    reading one line at a time. Returns None if the column is not in the header. When a header name is repeated the last
+    column with that name is read, the same as in the column store.
+    """
+    header = parse_header(fileobj.readline(), delimiter)
+    if column not in header:
+        return None
+    index = len(header) - 1 - header[::-1].index(column)
+    values = {}
+    # lines are read with readline as iterating a django File starts over from the beginning of the file
+    for line in iter(fileobj.readline, b""):
+        data = parse_header(line, delimiter)
+        if index < len(data) and data[index] != "":
+            values[data[index]] = True
+    return list(values)
+
+
+def _arrow_batches(fileobj, header: List[str], delimiter: str):
+    names = [f"c{i}" for i in range(len(header))]
+    fileobj.seek(0)
+    reader = pa_csv.open_csv(
+        fileobj,
+        read_options=pa_csv.ReadOptions(column_names=names, skip_rows=1, block_size=COLUMN_BLOCK_SIZE),
+        parse_options=pa_csv.ParseOptions(delimiter=delimiter, quote_char='"', ignore_empty_lines=False),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={n: pa.string() for n in names}, strings_can_be_null=False, quoted_strings_can_be_null=False
+        ),
+    )
+    for batch in reader:
+        yield batch
+
+
+def _line_batches(fileobj, header: List[str], delimiter: str):
+    fileobj.seek(0)
+    fileobj.readline()
+    columns = [[] for _ in header]
+    count = 0
+    # lines are read with readline as iterating a django File starts over from the beginning of the file
+    for line in iter(fileobj.readline, b""):
+        data = parse_header(line, delimiter)
+        for i, column in enumerate(columns):
+            column.append(data[i] if i < len(data) else "")
+        count += 1
+        if count == COLUMN_BATCH_ROWS:
+            yield pa.record_batch([pa.array(c, type=pa.string()) for c in columns], names=[f"c{i}" for i in range(len(header))])
+            columns = [[] for _ in header]
+            count = 0
+    if count:
+        yield pa.record_batch([pa.array(c, type=pa.string()) for c in columns], names=[f"c{i}" for i in range(len(header))])
+
+
+def _write_batches(sink, schema: pa.Schema, batches) -> int:
+    rows = 0
+    with pa.ipc.new_file(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
+
+
+def _write_text_columns(fileobj, delimiter: str, row_count: int, open_sink):
+    """
+    Stream the data rows of a file into an Arrow IPC file with one string column per header column, one record batch at
+    a time. When a header name is repeated the last column with that name is kept, the same as the column header map
+    used by the search. The fast path uses the Arrow csv reader, a line by line parse is used instead when the file has
+    rows that do not fit the header so that table row n always matches line n + 2 of the file.
+    """
+    header = parse_header(fileobj.readline(), delimiter)
+    last_index = {name: i for i, name in enumerate(header)}
+    names = [name for i, name in enumerate(header) if last_index[name] == i]
+    schema = pa.schema([(name, pa.string()) for name in names])
+
+    def select(batches):
+        for batch in batches:
+            yield pa.record_batch([batch.column(last_index[n]) for n in names], schema=schema)
+
+    try:
+        sink = open_sink()
+        if _write_batches(sink, schema, select(_arrow_batches(fileobj, header, delimiter))) == row_count:
+            return sink
+    except pa.ArrowInvalid:
+        pass
+    sink = open_sink()
+    _write_batches(sink, schema, select(_line_batches(fileobj, header, delimiter)))
+    return sink
+
+
+def _to_numeric(column: pa.Array) -> Optional[pa.Array]:
+    column = pc.if_else(pc.equal(column, ""), pa.scalar(None, pa.string()), column)
+    try:
+        return pc.fill_null(pc.cast(column, pa.float64()), np.nan)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return None
+
+
+def _write_numeric_columns(text: pa.ipc.RecordBatchFileReader, sink):
+    """
+    Write the columns of a text column file where every non empty cell is a number as float64, reading the text one
+    record batch at a time
+    """
+    names = list(text.schema.names)
+    for i in range(text.num_record_batches):
+        batch = text.get_batch(i)
+        names = [name for name in names if _to_numeric(batch.column(name)) is not None]
+    schema = pa.schema([(name, pa.float64()) for name in names])
+    batches = (
+        pa.record_batch([_to_numeric(text.get_batch(i).column(n)) for n in names], schema=schema)
+        for i in range(text.num_record_batches)
+    ) if names else []
+    _write_batches(sink, schema, batches)
+
+
+def compute_columns(fileobj, delimiter: str, row_count: int) -> (pa.Table, pa.Table):
+    """
+    Build the text and numeric column tables of a delimited binary file object in memory
+    """
+    text_sink = _write_text_columns(fileobj, delimiter, row_count, pa.BufferOutputStream)
+    text = pa.ipc.open_file(text_sink.getvalue())
+    numeric_sink = pa.BufferOutputStream()
+    _write_numeric_columns(text, numeric_sink)
+    return text.read_all(), pa.ipc.open_file(numeric_sink.getvalue()).read_all()
+
+
+def write_columns(file_hash: str, fileobj, delimiter: str, row_count: int):
+    """
+    Build the text and numeric column files of a delimited binary file object. Rows are streamed in record batches so
+    the memory used does not grow with the size of the file.
+    """
+    directory = artifact_dir(file_hash, create=True)
+    text_path = os.path.join(directory, COLUMNS_FILE)
+    numeric_path = os.path.join(directory, NUMERIC_COLUMNS_FILE)
+    text_tmp_path = temp_path(text_path)
+    numeric_tmp_path = temp_path(numeric_path)
+    sinks = []
+
+    def open_sink():
+        for sink in sinks:
+            sink.close()
+        sinks.append(pa.OSFile(text_tmp_path, "wb"))
+        return sinks[-1]
+
+    try:
+        try:
+            _write_text_columns(fileobj, delimiter, row_count, open_sink)
+        finally:
+            for sink in sinks:
+                sink.close()
+        with pa.OSFile(numeric_tmp_path, "wb") as sink:
+            _write_numeric_columns(pa.ipc.open_file(pa.memory_map(text_tmp_path)), sink)
+        os.replace(numeric_tmp_path, numeric_path)
+        # the text file is moved in place last as its presence marks the column store as complete
+        os.replace(text_tmp_path, text_path)
+    finally:
+        remove_file(numeric_tmp_path)
+        remove_file(text_tmp_path)
+
+
+def load_columns(file_hash: str) -> Optional[tuple]:
+    """
+    Load the text and numeric column tables of a file memory-mapped, returns None if they have not been built yet
+    """
+    directory = artifact_dir(file_hash)
+    text_path = os.path.join(directory, COLUMNS_FILE)
+    if not os.path.exists(text_path):
+        return None
+    return (
+        pa.ipc.open_file(pa.memory_map(text_path)).read_all(),
+        pa.ipc.open_file(pa.memory_map(os.path.join(directory, NUMERIC_COLUMNS_FILE))).read_all(),
+    )
+
+
+def unique_text_values(table: pa.Table, column: str) -> Optional[List[str]]:
+    """
+    Return the distinct non empty values of a column of a text column table in the order they first appear, or None if
+    the table has no such column
+    """
+    if column not in table.column_names:
+        return None
+    return [v for v in pc.unique(table.column(column)).to_pylist() if v != ""]
+
+
+def row_indices(rows: Optional[List[int]], num_rows: int) -> Optional[np.ndarray]:
+    """
+    Convert 1-based file line numbers into table row indices, line 2 being the first data row
+    """
+    if rows is None:
+        return None
+    indices = np.asarray(rows, dtype=np.int64) - 2
+    if len(indices) and (indices.min() < 0 or indices.max() >= num_rows):
+        raise IndexError("row out of range")
+    return indices
+
+
+def take_text_columns(table: pa.Table, columns: List[str], rows: Optional[List[int]] = None) -> Dict[str, List[str]]:
+    indices = row_indices(rows, table.num_rows)
+    result = {}
+    for name in dict.fromkeys(columns):
+        if name in table.column_names:
+            column = table.column(name)
+            result[name] = (column if indices is None else column.take(indices)).to_pylist()
+    return result
+
+
+def take_numeric_columns(text: pa.Table, numeric: pa.Table, columns: List[str], rows: Optional[List[int]] = None) -> Dict[str, np.ndarray]:
+    """
+    Return float64 arrays for the requested columns, empty cells are NaN. Columns that are not fully numeric are
+    converted from text and their non numeric cells also become NaN.
+    """
+    indices = row_indices(rows, text.num_rows)
+    result = {}
+    for name in dict.fromkeys(columns):
+        if name in numeric.column_names:
+            column = numeric.column(name)
+        elif name in text.column_names:
+            column = text.column(name)
+        else:
+            continue
+        if indices is not None:
+            column = column.take(indices)
+        if name in numeric.column_names:
+            result[name] = column.to_numpy()
+        else:
+            result[name] = pd.to_numeric(pd.Series(column.to_pylist(), dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+    return result
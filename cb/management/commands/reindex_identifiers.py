@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from cb.models import ProjectFile
+
+
+class Command(BaseCommand):
+    help = 'Hash and index every project file without an identifier index, the same as the ingest worker does.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rebuild the identifier index of files that are already indexed.')
+
+    def handle(self, *args, **options):
+        files = ProjectFile.objects.filter(file__isnull=False).exclude(file="")
+        if not options.get('all'):
+            files = files.filter(identifier_indexed=False)
+        else:
+            files.update(identifier_indexed=False)
+        for project_file in files.order_by('id'):
+            project_file.save_altered(update_fields=["file", "hash", "updated_at"])
+            self.stdout.write(f"Indexed {project_file.name} ({project_file.id})")
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cb', '0045_userprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectfile',
+            name='identifier_indexed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='ProjectFileIdentifier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('column_type', models.CharField(choices=[('pi', 'Primary IDs'), ('gene', 'Gene names'), ('uniprot', 'UniProt Accession IDs')], max_length=20)),
+                ('value', models.CharField(max_length=255)),
+                ('row', models.IntegerField()),
+                ('offset', models.BigIntegerField()),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='identifiers', to='cb.projectfile')),
+            ],
+            options={
+                'ordering': ['row'],
+                'indexes': [models.Index(fields=['column_type', 'value'], name='cb_projectf_column__e90b02_idx')],
+            },
+        ),
+    ]
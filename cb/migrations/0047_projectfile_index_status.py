@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cb', '0046_projectfileidentifier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectfile',
+            name='index_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=20),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cb', '0047_projectfile_index_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectfile',
+            name='row_tokens_indexed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='FileRowToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_hash', models.CharField(max_length=255)),
+                ('token', models.CharField(max_length=255)),
+                ('row', models.IntegerField()),
+            ],
+            options={
+                'ordering': ['row'],
+                'indexes': [models.Index(fields=['token', 'file_hash'], name='cb_filerowt_token_f18c81_idx'), models.Index(fields=['file_hash'], name='cb_filerowt_file_ha_ac0edc_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cb', '0049_filerowtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchsession',
+            name='match_type',
+            field=models.CharField(choices=[('exact', 'Exact'), ('isoform', 'Ignore isoform suffix'), ('prefix', 'Prefix'), ('fuzzy', 'Fuzzy')], default='exact', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cb', '0050_searchsession_match_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectfile',
+            name='identifier_bloom',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
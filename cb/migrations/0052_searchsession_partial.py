@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cb', '0051_projectfile_identifier_bloom'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchsession',
+            name='partial',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cb', '0052_searchsession_partial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchsession',
+            name='cancelled',
+            field=models.BooleanField(default=False),
+        ),
+    ]
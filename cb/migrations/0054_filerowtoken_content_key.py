@@ -0,0 +1,42 @@
+# Generated by Django 5.1.5 on 2026-10-17 21:10
+
+from django.db import migrations, models
+
+
+def drop_row_tokens(apps, schema_editor):
+    # tokens were read from every cell of a row and keyed by file hash only, they are rebuilt from the identifier
+    # columns by the reindex_row_tokens command
+    apps.get_model('cb', 'FileRowToken').objects.all().delete()
+    apps.get_model('cb', 'ProjectFile').objects.update(row_tokens_indexed=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cb', '0053_searchsession_cancelled'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_row_tokens, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='filerowtoken',
+            name='cb_filerowt_token_f18c81_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='filerowtoken',
+            name='cb_filerowt_file_ha_ac0edc_idx',
+        ),
+        migrations.RenameField(
+            model_name='filerowtoken',
+            old_name='file_hash',
+            new_name='content_key',
+        ),
+        migrations.AddIndex(
+            model_name='filerowtoken',
+            index=models.Index(fields=['token', 'content_key'], name='cb_filerowt_token_9b988f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filerowtoken',
+            index=models.Index(fields=['content_key'], name='cb_filerowt_content_897b96_idx'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.1.5 on 2026-10-17 21:34
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+IDENTIFIER_SEARCH_MODES = {
+    "pi": "primary_id_col",
+    "gene": "gene_name_col",
+    "uniprot": "uniprot_id_col",
+}
+
+
+def identifier_key(file_hash, extra_data):
+    # the same key as ProjectFile.get_identifier_key at the time of this migration
+    extra_data = json.loads(extra_data or "{}")
+    columns = {column_type: extra_data[key] for column_type, key in IDENTIFIER_SEARCH_MODES.items() if extra_data.get(key)}
+    return f"{file_hash}:{hashlib.sha256(json.dumps(columns, sort_keys=True).encode()).hexdigest()[:16]}"
+
+
+def key_identifiers(apps, schema_editor):
+    # the index of every hashed file is kept under its content key so that files are not indexed again, files with the
+    # same key keep the index of the first of them and files without a hash are indexed again by the worker
+    ProjectFile = apps.get_model('cb', 'ProjectFile')
+    ProjectFileIdentifier = apps.get_model('cb', 'ProjectFileIdentifier')
+    keys = set()
+    for file_id, file_hash, extra_data in ProjectFile.objects.filter(identifier_indexed=True).exclude(hash="").order_by("id").values_list("id", "hash", "extra_data"):
+        key = identifier_key(file_hash, extra_data)
+        if key in keys:
+            ProjectFileIdentifier.objects.filter(file_id=file_id).delete()
+        else:
+            ProjectFileIdentifier.objects.filter(file_id=file_id).update(content_key=key)
+            keys.add(key)
+    ProjectFileIdentifier.objects.filter(content_key="").delete()
+    ProjectFile.objects.filter(identifier_indexed=True, hash="").update(identifier_indexed=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cb', '0054_filerowtoken_content_key'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='FileRowToken',
+        ),
+        migrations.RemoveField(
+            model_name='projectfile',
+            name='row_tokens_indexed',
+        ),
+        migrations.AddField(
+            model_name='projectfileidentifier',
+            name='content_key',
+            field=models.CharField(default='', max_length=255),
+            preserve_default=False,
+        ),
+        migrations.RunPython(key_identifiers, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='projectfileidentifier',
+            name='cb_projectf_column__e90b02_idx',
+        ),
+        migrations.RemoveField(
+            model_name='projectfileidentifier',
+            name='file',
+        ),
+        migrations.AddIndex(
+            model_name='projectfileidentifier',
+            index=models.Index(fields=['column_type', 'value', 'content_key'], name='cb_projectf_column__value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectfileidentifier',
+            index=models.Index(fields=['content_key', 'column_type'], name='cb_projectf_content_key_idx', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']),
+        ),
+    ]
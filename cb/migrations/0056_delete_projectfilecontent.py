@@ -0,0 +1,16 @@
+# Generated by Django 5.1.5 on 2026-10-17 21:38
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cb', '0055_projectfileidentifier_content_key'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='ProjectFileContent',
+        ),
+    ]
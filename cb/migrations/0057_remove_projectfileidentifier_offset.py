@@ -0,0 +1,17 @@
+# Generated by Django 5.1.5 on 2026-10-17 21:39
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cb', '0056_delete_projectfilecontent'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='projectfileidentifier',
+            name='offset',
+        ),
+    ]
@@ -4,25 +4,28 @@ import io
 import json
 import os
 import re
-import subprocess
+import shutil
 import uuid
+from datetime import timedelta
 from typing import List, Dict, Optional
 
 import numpy as np
 import pandas as pd
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from curtainutils.client import CurtainClient, CurtainUniprotData
-from django.contrib.postgres.indexes import GinIndex
-from django.contrib.postgres.search import SearchVectorField, SearchHeadline, SearchVector, SearchQuery
 from django.db import models, transaction
-from django.db.models import Func
-from django.db.models.signals import post_save
+from django.core.cache import cache
+from django.db.models import Func, Q
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from rest_framework.authtoken.models import Token
 from django.conf import settings
 
-import cb
+from cb import file_index
+from cb.bloom import BloomFilter
+from cb.executor import run_tasks
+from cb.progress import ProgressReporter
 from cb.utils import default_columns
 
 
@@ -46,6 +49,72 @@ def split_terms(input_term):
 
     return term_dict
 
+# search modes that are answered from the identifier index and the extra_data column each of them is built from
+IDENTIFIER_SEARCH_MODES = {
+    "pi": "primary_id_col",
+    "gene": "gene_name_col",
+    "uniprot": "uniprot_id_col",
+}
+
+def split_identifiers(value):
+    """
+    Normalize an identifier cell into its lowercase members. Protein groups such as P12345;Q67890 are split on ";".
+    """
+    members = []
+    for member in value.split(";"):
+        member = member.strip().lower()[:255]
+        if member and member not in members:
+            members.append(member)
+    return members
+
+# isoform suffix of an accession such as the -2 of P12345-2
+ISOFORM_SUFFIX = re.compile(r"-\d+$")
+
+def isoform_base(value):
+    """
+    Strip the isoform suffix of a normalized identifier so that P12345-2 and P12345 share the same base
+    """
+    return ISOFORM_SUFFIX.sub("", value)
+
+def identifier_bloom_keys(column_type, value):
+    """
+    Return the keys an identifier is stored under in the bloom filter of a file, the identifier itself and its isoform
+    base so that both the exact and the isoform match types can be checked
+    """
+    return [f"{column_type}:{value}", f"{column_type}~{isoform_base(value)}"]
+
+def search_cancel_cache_key(search_session_id) -> str:
+    return f"search_cancelled_{search_session_id}"
+
+def token_user_cache_key(token_key) -> str:
+    """
+    Cache key of the id of the user an auth token resolves to for websocket connections
+    """
+    return f"token_user_{token_key}"
+
+def upload_checksum_cache_key(upload_id) -> str:
+    """
+    Cache key of the sha256 checksum verified when a chunked upload completed
+    """
+    return f"chunked_upload_checksum_{upload_id}"
+
+def float_or_none(value):
+    """
+    Convert a cell read from the column store into a float, empty and NaN cells become None
+    """
+    if value is None or np.isnan(value):
+        return None
+    return float(value)
+
+def first_by_file(queryset) -> dict:
+    """
+    Map file id to the first object of the queryset for that file, the same object .filter(file=...).first() returns
+    """
+    first = {}
+    for item in queryset:
+        first.setdefault(item.file_id, item)
+    return first
+
 class Abs(Func):
     function = 'ABS'
 
@@ -135,6 +204,15 @@ class ProjectFile(models.Model):
     metadata = models.TextField(blank=True, null=True)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='files', blank=True, null=True)
     extra_data = models.TextField(blank=True, null=True)
+    identifier_indexed = models.BooleanField(default=False)
+    identifier_bloom = models.BinaryField(blank=True, null=True)
+    index_status_choices = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+    index_status = models.CharField(max_length=20, choices=index_status_choices, default='ready')
 
     class Meta:
         ordering = ['created_at']
@@ -143,102 +221,262 @@ class ProjectFile(models.Model):
     def __str__(self):
         return self.name
 
-    def delete(self, using=None, keep_parents=False):
-        self.file.delete()
-        super().delete(using, keep_parents)
+    def release_content(self, file_hash: str):
+        """
+        Method to drop the reference of this file to the blob, identifier index and derived artifacts of a hash. They are
+        kept for another file with the same content if there is one and removed otherwise.
+        """
+        if not file_hash:
+            return
+        if ProjectFile.objects.filter(hash=file_hash).exclude(id=self.id).exists():
+            ProjectFile.prune_identifiers(file_hash, exclude_id=self.id)
+            return
+        self.file.storage.delete(file_index.blob_name(file_hash))
+        ProjectFileIdentifier.objects.filter(content_key__startswith=f"{file_hash}:").delete()
+        file_index.remove_artifacts(file_hash)
+
+    def store_blob(self):
+        """
+        Method to move the file into the content-addressed blob store named after its hash. If the blob already exists
+        the copy of this file is removed and the existing blob is used instead.
+        """
+        name = file_index.blob_name(self.hash)
+        if self.file.name == name:
+            return
+        storage = self.file.storage
+        self.file.close()
+        if storage.exists(name):
+            storage.delete(self.file.name)
+        else:
+            path = storage.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.move(self.file.path, path)
+        # assigning the name replaces the field file so no handle of the previous file is reused
+        self.file = name
 
     def save(self, *args, **kwargs):
         return super().save(*args, **kwargs)
 
-    def save_altered(self, *args, **kwargs):
-        # calculate sha256 hash of the file
+    def save_altered(self, *args, on_step=None, file_hash=None, **kwargs):
+        """
+        Method to save the file and rebuild its content, row index, column store and identifier index when its content
+        changed, or build the ones it is missing when it did not. on_step is called with the name of every step before
+        it runs. file_hash is the sha256 of the file when it is already known, the file is then not read again to hash
+        it. The file is moved into the blob store and the identifier index, row index and column store are only built if
+        no other file with the same content has them.
+        """
         if self.file:
-            hasher = hashlib.sha256()
-            with self.file.open('rb') as afile:
-                for chunk in iter(lambda: afile.read(4096), b""):
-                    hasher.update(chunk)
-            data_hash = hasher.hexdigest()
+            if file_hash:
+                data_hash = file_hash
+            else:
+                if on_step:
+                    on_step("hash")
+                data_hash = self.compute_hash()
             if data_hash != self.hash:
+                previous_hash = self.hash
                 self.hash = data_hash
-                if self.load_file_content:
-                    self.load_file()
+                self.identifier_indexed = False
+                self.store_blob()
+                # the blob name and hash are saved before anything else runs so that the row never points at the moved
+                # upload if a later step fails, and so that other files see this one holding the blob
+                ProjectFile.objects.filter(id=self.id).update(file=self.file.name, hash=self.hash, identifier_indexed=False)
+                self.release_content(previous_hash)
+            # the row index and column store are only built when they are missing for the hash
+            steps = [("row_index", self.get_row_offsets), ("columns", self.get_columnar_cache)]
+            if not self.identifier_indexed:
+                steps.append(("identifiers", self.build_identifier_index))
+            for step, build in steps:
+                if on_step:
+                    on_step(step)
+                build()
 
         return super().save(*args, **kwargs)
 
-    def load_file(self):
+    def compute_hash(self) -> str:
         """
-        Method to load the content of the file into the database
+        Method to calculate the sha256 hash of the file
         """
-        content = self.file_contents.all()
-        if content.exists():
-            content.delete()
-        with open(self.file.path, 'rt') as file:
-            content = file.read()
-            content = re.split(r"[\s\n\t]", content)
-            chunk_size = 50000
-            for i in range(0, len(content), chunk_size):
-                if i + chunk_size < len(content):
-                    ProjectFileContent.objects.create(file=self, content=" ".join(content[i:i + chunk_size]))
-                else:
-                    ProjectFileContent.objects.create(file=self, content=" ".join(content[i:]))
-
-    def remove_file_content(self):
-        self.file_contents.all().delete()
-
-    def get_search_items_from_headline(self, split_term_dict: Dict[str, List[str]]) -> Optional[Dict[str, List[str]]]:
-        if getattr(self, "headline", None):
-            #pattern = '(?<!\S)(?<!-|\w)(;)*<b>(.*?)</b>'
-            pattern = r'<b>(.*?)</b>'
-            term_contexts = {}
-            for match in re.finditer(pattern, self.headline):
-
-                if match:
-                    m = match.group(1)
-                    match_lower = m.lower()
-                    found = False
-                    if match_lower not in split_term_dict:
-                        continue
-                    term_length = len(m)
-                    for term in split_term_dict[match_lower]:
-                        if term == match_lower:
-                            found = True
-                            break
-
-                        original_term_length = len(term)
-                        if original_term_length > len(m):
-                            leftover = term[term_length:]
-                            leftover_length = len(leftover)
-                            match_position_after_b = match.end(0)
-                            try:
-                                leftover_equilavent = self.headline[match_position_after_b:match_position_after_b+leftover_length]
-                                if "<b" in leftover_equilavent:
-                                    leftover_equilavent = self.headline[match_position_after_b:match_position_after_b+leftover_length+3].replace("<b>", "")
-                                if leftover == leftover_equilavent.lower():
-                                    m = m+leftover_equilavent
-                                    found = True
-                                    break
-                            except IndexError:
-                                continue
-
-                    if not found:
+        hasher = hashlib.sha256()
+        with self.file.open('rb') as afile:
+            for chunk in iter(lambda: afile.read(1 << 20), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def link_file(self, source_path: str, filename: str) -> bool:
+        """
+        Method to point the file field at an existing file without copying its content. The file is hard-linked into
+        the upload folder of the field when possible and moved there otherwise. Returns True if source_path still exists.
+        """
+        storage = self.file.storage
+        name = storage.get_available_name(self.file.field.generate_filename(self, filename))
+        path = storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(source_path, path)
+            linked = True
+        except FileExistsError:
+            # FileExistsError is an OSError, re-raised so that a name taken by another upload since
+            # get_available_name is not overwritten by the move below
+            raise
+        except OSError:
+            # hard links are not possible across file systems or on some storages
+            shutil.move(source_path, path)
+            linked = False
+        self.file.name = name
+        return linked
+
+    def queue_processing(self, session_id: str = None, from_status: str = None) -> bool:
+        """
+        Method to hand the hashing and indexing of the file to the ingest worker. The file is set to pending so searches
+        leave it out until the worker has set it to ready. With from_status the file is only queued if it is in that
+        status, so that concurrent callers queue it once. Returns whether the file was queued.
+        """
+        from cb.rq_tasks import process_project_file
+
+        files = ProjectFile.objects.filter(id=self.id)
+        if from_status:
+            files = files.filter(index_status=from_status)
+        if not files.update(index_status="pending"):
+            return False
+        self.index_status = "pending"
+        process_project_file.delay(self.id, session_id, self.hash or None)
+        return True
+
+    def get_identifier_columns(self) -> Dict[str, str]:
+        """
+        Return the primary id, gene name and uniprot id columns set in extra_data keyed by the search mode they serve
+        """
+        extra_data = json.loads(self.extra_data or "{}")
+        return {column_type: extra_data[key] for column_type, key in IDENTIFIER_SEARCH_MODES.items() if extra_data.get(key)}
+
+    def get_identifier_key(self) -> str:
+        """
+        Return the key the identifier index of the file is stored under. Files with the same content share their index
+        when they also read it from the same columns.
+        """
+        columns = hashlib.sha256(json.dumps(self.get_identifier_columns(), sort_keys=True).encode()).hexdigest()[:16]
+        return f"{self.hash}:{columns}"
+
+    def get_identifiers(self):
+        return ProjectFileIdentifier.objects.filter(content_key=self.get_identifier_key())
+
+    @classmethod
+    def prune_identifiers(cls, file_hash: str, exclude_id: int = None, keep: str = None):
+        """
+        Remove the identifier index of a hash that no file with that hash reads from its columns anymore, the index under
+        the keep key is always kept
+        """
+        files = cls.objects.filter(hash=file_hash)
+        if exclude_id is not None:
+            files = files.exclude(id=exclude_id)
+        keys = {f.get_identifier_key() for f in files} | ({keep} if keep else set())
+        ProjectFileIdentifier.objects.filter(content_key__startswith=f"{file_hash}:").exclude(content_key__in=keys).delete()
+
+    def build_identifier_index(self, only_missing: bool = False):
+        """
+        Method to build the inverted index of the primary id, gene name and uniprot id columns set in extra_data.
+        Each identifier is stored with the row number of the line it was found in. The index is stored
+        once per content and columns and shared by every file with both. The sorted distinct identifiers of every
+        column are also saved next to the file for the prefix, isoform and fuzzy match types, and a bloom filter of them
+        is kept on the file so that searches can skip files that cannot hold their terms.
+        The index is rebuilt under a lock on the file and the files with the same content so concurrent builds run one
+        after the other, with only_missing a build that waited for another one to finish is skipped. The columns are
+        read from the extra_data saved on the file when the lock is taken so that a change made after this instance was
+        loaded is not lost.
+        """
+        if self.file and not self.hash:
+            # the index is keyed on the content so the file is hashed and moved into the blob store first, which builds it
+            self.save_altered(update_fields=["file", "hash", "updated_at"])
+            return
+        with transaction.atomic():
+            locked = ProjectFile.objects.select_for_update().filter(id=self.id).values_list("identifier_indexed", "identifier_bloom", "extra_data").first()
+            if locked:
+                self.extra_data = locked[2]
+            if only_missing and locked and locked[0]:
+                self.identifier_indexed, self.identifier_bloom = locked[:2]
+                return
+            key = self.get_identifier_key()
+            shared = None
+            if self.hash:
+                others = ProjectFile.objects.select_for_update().filter(hash=self.hash, identifier_indexed=True).exclude(id=self.id)
+                shared = next((f for f in others if f.get_identifier_key() == key), None)
+            if shared is not None:
+                # another file with the same content and columns already holds the index
+                bloom = bytes(shared.identifier_bloom) if shared.identifier_bloom is not None else None
+            else:
+                bloom = self.index_identifiers(key)
+            self.identifier_bloom = bloom
+            self.identifier_indexed = True
+            ProjectFile.objects.filter(id=self.id).update(identifier_indexed=True, identifier_bloom=self.identifier_bloom)
+            if self.hash:
+                # the hash of the file may not be saved yet so its own key is kept explicitly
+                ProjectFile.prune_identifiers(self.hash, keep=key)
+
+    def index_identifiers(self, key: str) -> bytes:
+        """
+        Read the identifier columns of the file into the index under key and return the bloom filter of the identifiers
+        """
+        ProjectFileIdentifier.objects.filter(content_key=key).delete()
+        delimiter = self.get_delimiter()
+        columns = self.get_identifier_columns() if self.file and delimiter else {}
+        vocabularies = {column_type: set() for column_type in columns}
+        if columns:
+            batch = []
+            column_index = {}
+            with self.file.open("rb") as f:
+                for row, line in enumerate(f, 1):
+                    data = next(csv.reader([line.decode("utf-8", errors="replace").rstrip("\r\n")], delimiter=delimiter, quotechar='"'), [])
+                    if row == 1:
+                        column_index = {t: data.index(c) for t, c in columns.items() if c in data}
                         continue
-                    if m not in term_contexts:
-                        term_contexts[m] = []
-                    start = match.start(0)
-                    end = match.end(0)
-                    # get a window of 10 words before and after the match
-                    window = 20
-                    start_window = start - window
-                    end_window = end + window
-                    if start_window < 0:
-                        start_window = 0
-                    if end_window > len(self.headline):
-                        end_window = len(self.headline)
-                    term_contexts[m].append(self.headline[start_window:end_window])
-
-            return term_contexts
-        else:
-            return None
+                    for column_type, index in column_index.items():
+                        if index < len(data):
+                            for value in split_identifiers(data[index]):
+                                vocabularies[column_type].add(value)
+                                batch.append(ProjectFileIdentifier(content_key=key, column_type=column_type, value=value, row=row))
+                    if len(batch) >= 5000:
+                        ProjectFileIdentifier.objects.bulk_create(batch)
+                        batch = []
+            if batch:
+                ProjectFileIdentifier.objects.bulk_create(batch)
+            if self.hash:
+                for column_type, values in vocabularies.items():
+                    file_index.save_vocabulary(self.hash, columns[column_type], values)
+        bloom = BloomFilter.from_values(
+            (bloom_key for column_type, values in vocabularies.items() for value in values for bloom_key in identifier_bloom_keys(column_type, value)),
+            settings.SEARCH_BLOOM_FALSE_POSITIVE_RATE
+        )
+        return bloom.to_bytes()
+
+    def get_identifier_vocabulary(self, column_type: str) -> np.ndarray:
+        """
+        Return the sorted distinct identifiers of the column of the given search mode. Files indexed before the
+        identifiers were saved next to the file get them from the identifier index.
+        """
+        column = json.loads(self.extra_data or "{}").get(IDENTIFIER_SEARCH_MODES[column_type])
+        if not column:
+            return np.array([], dtype=str)
+        if self.hash:
+            vocabulary = file_index.load_vocabulary(self.hash, column)
+            if vocabulary is not None:
+                return vocabulary
+        values = self.get_identifiers().filter(column_type=column_type).values_list("value", flat=True).distinct()
+        if self.hash:
+            return file_index.save_vocabulary(self.hash, column, values)
+        return np.array(sorted(values), dtype=str)
+
+    def get_row_numbers_for_primary_ids(self, primary_ids) -> List[int]:
+        """
+        Return the line numbers of the rows whose primary id column contains any member of the given primary ids
+        """
+        if not self.identifier_indexed:
+            # the index is built by the ingest worker rather than by the search, the file is left out until then
+            self.queue_processing(from_status="ready")
+            return []
+        members = {m for primary_id in primary_ids for m in split_identifiers(primary_id)}
+        if not members:
+            return []
+        return list(self.get_identifiers().filter(column_type="pi", value__in=members).order_by("row").values_list("row", flat=True).distinct())
 
     def get_delimiter(self):
         if self.file_type == "csv":
@@ -250,47 +488,140 @@ class ProjectFile(models.Model):
         else:
             return None
 
+    def build_row_index(self):
+        """
+        Method to build the sidecar index of the byte offset of every line of the file
+        """
+        with self.file.open("rb") as f:
+            offsets = file_index.compute_row_offsets(f)
+        file_index.save_row_offsets(self.hash, offsets)
+        return offsets
+
+    def get_row_offsets(self):
+        if self.hash:
+            offsets = file_index.load_row_offsets(self.hash)
+            if offsets is not None:
+                return offsets
+            return self.build_row_index()
+        with self.file.open("rb") as f:
+            return file_index.compute_row_offsets(f)
+
+    def compute_columnar_cache(self):
+        offsets = self.get_row_offsets()
+        with self.file.open("rb") as f:
+            return file_index.compute_columns(f, self.get_delimiter(), max(len(offsets) - 1, 0))
+
+    def build_columnar_cache(self):
+        """
+        Method to build the column store of the file. Every column is kept as text and the numeric columns are also kept
+        as float64 so that searches only read the columns they need without parsing rows.
+        """
+        if not self.get_delimiter():
+            return None
+        offsets = self.get_row_offsets()
+        with self.file.open("rb") as f:
+            file_index.write_columns(self.hash, f, self.get_delimiter(), max(len(offsets) - 1, 0))
+        return file_index.load_columns(self.hash)
+
+    def get_columnar_cache(self):
+        if self.hash:
+            tables = file_index.load_columns(self.hash)
+            if tables is not None:
+                return tables
+            return self.build_columnar_cache()
+        if self.get_delimiter():
+            return self.compute_columnar_cache()
+        return None
+
+    def get_column_names(self) -> List[str]:
+        """
+        Return the header of the file, only its first line is read
+        """
+        delimiter = self.get_delimiter()
+        if not self.file or not delimiter:
+            return []
+        with self.file.open("rb") as f:
+            return file_index.parse_header(f.readline(), delimiter)
+
+    def get_unique_values(self, column: str) -> Optional[List[str]]:
+        """
+        Return the distinct non empty values of a column in the order they first appear, or None if the file has no such
+        column. They are read from the column store when it has been built, otherwise the file is read one line at a
+        time without building the column store.
+        """
+        delimiter = self.get_delimiter()
+        if not self.file or not delimiter:
+            return None
+        if self.hash:
+            tables = file_index.load_columns(self.hash)
+            if tables is not None:
+                return file_index.unique_text_values(tables[0], column)
+        with self.file.open("rb") as f:
+            return file_index.unique_column_values(f, delimiter, column)
+
+    def read_columns(self, columns: List[str], rows: Optional[List[int]] = None) -> Dict[str, List[str]]:
+        """
+        Read the text of the given columns for the given 1-based line numbers, or for every row if rows is None.
+        Columns that are not in the file are left out of the result.
+        """
+        tables = self.get_columnar_cache()
+        if tables is None:
+            return {}
+        return file_index.take_text_columns(tables[0], columns, rows)
+
+    def read_numeric_columns(self, columns: List[str], rows: Optional[List[int]] = None) -> Dict[str, np.ndarray]:
+        """
+        Read the given columns as float64 arrays for the given 1-based line numbers, empty cells are NaN
+        """
+        tables = self.get_columnar_cache()
+        if tables is None:
+            return {}
+        return file_index.take_numeric_columns(tables[0], tables[1], columns, rows)
+
     def get_file_line(self, line_numbers: list[int]):
-        with self.file.open("rt") as f:
-            line = f.readline()
-            delimiter = self.get_delimiter()
-            headers = line.rstrip().split(delimiter)
-            for i, line in enumerate(f):
-                if i > 0:
-                    if i+1 in line_numbers:
-                        line = line.rstrip()
-                        data = line.split(delimiter)
-                        yield i+1, dict(zip(headers, data))
-
-# ProjectFileContent model represents a segment of text content from a file.
-# Each ProjectFileContent has a file, content, created_at, updated_at, search_vector fields.
-class ProjectFileContent(models.Model):
+        """
+        Fetch rows by their 1-based line number, the header being line 1.
+        Rows are read by seeking to their offset and are yielded in the requested order as (line number, row dict).
+        """
+        offsets = self.get_row_offsets()
+        requested = [n for n in line_numbers if 1 < n <= len(offsets)]
+        delimiter = self.get_delimiter()
+        with self.file.open("rb") as f:
+            headers = f.readline().decode("utf-8", errors="replace").rstrip("\r\n").split(delimiter)
+            for n in requested:
+                f.seek(int(offsets[n - 1]))
+                data = f.readline().decode("utf-8", errors="replace").rstrip("\r\n").split(delimiter)
+                yield n, dict(zip(headers, data))
+
+class ProjectFileIdentifier(models.Model):
     """
-    A model to store segments of text content from a file. A file would be broken down into multiple segments, each would become a ProjectFileContent object
-    The model would be used to provide a way for searching through text content of loaded files utilizing postgres full text search.
-    The model also hold a GIN index on the search_vector field to speed up search queries.
+    A model to store the inverted index of the identifier columns of a file.
+    Each row maps a normalized primary id, gene name or uniprot id to the row number of the line it appears in
+    so that searches can seek directly to the matching lines instead of scanning the file. The index is stored once per
+    file hash and identifier columns, content_key being f"{hash}:{digest of the columns}", and shared by every file with
+    that content and columns.
     """
-    file = models.ForeignKey(ProjectFile, on_delete=models.CASCADE, related_name='file_contents', blank=True, null=True)
-    content = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
-    search_vector = SearchVectorField(null=True)
+    content_key = models.CharField(max_length=255)
+    column_type_choices = [
+        ('pi', "Primary IDs"),
+        ('gene', "Gene names"),
+        ('uniprot', "UniProt Accession IDs"),
+    ]
+    column_type = models.CharField(max_length=20, choices=column_type_choices)
+    value = models.CharField(max_length=255)
+    row = models.IntegerField()
 
     class Meta:
-        ordering = ['created_at']
+        ordering = ['row']
         app_label = 'cb'
         indexes = [
-            GinIndex(fields=["search_vector"])
+            models.Index(fields=["column_type", "value", "content_key"], name="cb_projectf_column__value_idx"),
+            # pattern ops so that the index of every key of a hash is found with a prefix match
+            models.Index(fields=["content_key", "column_type"], name="cb_projectf_content_key_idx", opclasses=["varchar_pattern_ops", "varchar_pattern_ops"]),
         ]
 
     def __str__(self):
-        if self.file:
-            return self.file.name + " - " + str(self.created_at)
-        return str(self.id)
-
-    def set_search_vector(self):
-        self.search_vector = SearchVector("content")
-        self.save()
+        return f"{self.value} - {self.row}"
 
 # ComparisonMatrix model represents a comparison matrix in the system.
 # Each ComparisonMatrix has a name, analysis_group, matrix, created_at, updated_at fields.
@@ -350,6 +681,16 @@ class SearchSession(models.Model):
         ('pi', "Primary IDs")
     ]
     search_mode = models.CharField(max_length=255, choices=search_mode_choices, default='full')
+    match_type_choices = [
+        ('exact', "Exact"),
+        ('isoform', "Ignore isoform suffix"),
+        ('prefix', "Prefix"),
+        ('fuzzy', "Fuzzy"),
+    ]
+    match_type = models.CharField(max_length=20, choices=match_type_choices, default='exact')
+    # set when the work budget stopped the search before every analysis group was searched
+    partial = models.BooleanField(default=False)
+    cancelled = models.BooleanField(default=False)
     failed = models.BooleanField(default=False)
     species = models.ForeignKey("Species", on_delete=models.SET_NULL, related_name="search_sessions", blank=True, null=True)
     data_type_choices = [
@@ -367,7 +708,38 @@ class SearchSession(models.Model):
         ordering = ['created_at']
         app_label = 'cb'
 
-    def search_data(self):
+    def cancel(self):
+        """
+        Ask a running search to stop. The flag is set in the cache, which the search checks between files, for as long
+        as a search job can run, and on the session so that a search that has not started yet does not run.
+        """
+        cache.set(search_cancel_cache_key(self.id), True, settings.SEARCH_JOB_TIMEOUT)
+        self.cancelled = True
+        SearchSession.objects.filter(id=self.id).update(cancelled=True)
+
+    def is_cancelled(self) -> bool:
+        return self.cancelled or bool(cache.get(search_cancel_cache_key(self.id)))
+
+    @classmethod
+    def count_active(cls, user=None, session_id=None) -> int:
+        """
+        Count the searches of a user, or of an anonymous websocket session, that are queued or running. Searches older
+        than the search job timeout are left out as their job cannot be running anymore.
+        """
+        sessions = cls.objects.filter(
+            Q(pending=True) | Q(in_progress=True), completed=False, failed=False, cancelled=False,
+            created_at__gte=timezone.now() - timedelta(seconds=settings.SEARCH_JOB_TIMEOUT)
+        )
+        if user is not None:
+            return sessions.filter(user=user).count()
+        return sessions.filter(user__isnull=True, session_id=session_id).count()
+
+    def search_data(self, reporter: ProgressReporter = None):
+        if SearchSession.objects.filter(id=self.id, cancelled=True).exists():
+            self.cancelled = True
+            self.pending = False
+            self.save()
+            return
         self.pending = False
         self.in_progress = True
         self.save()
@@ -375,391 +747,527 @@ class SearchSession(models.Model):
         if self.species:
             analysis_groups = analysis_groups.filter(project__species=self.species)
         if analysis_groups.exists():
-            files = ProjectFile.objects.filter(analysis_group__in=self.analysis_groups.all(), file_category__in=["df"])
+            files = ProjectFile.objects.filter(analysis_group__in=analysis_groups, file_category__in=["df"])
         else:
             files = ProjectFile.objects.filter(file_category__in=["df"])
+            if self.species:
+                files = files.filter(analysis_group__project__species=self.species)
+        # files that are still being hashed and indexed are left out of the search and its results are then not cached
+        complete = self.all_files_indexed(files)
+        files = files.filter(index_status="ready")
+        if reporter is None:
+            reporter = ProgressReporter("search", self.session_id, type="search_status", id=self.id)
+        cache_key = self.get_cache_key(files)
+        cached_session_id = cache.get(cache_key)
+        if cached_session_id and SearchSession.objects.filter(id=cached_session_id, completed=True, failed=False).exclude(id=self.id).exists():
+            result_count = self.copy_results_from(cached_session_id)
+            reporter.send("in_progress", found_files=0, current_progress=0, result_count=result_count, cached=True)
+            self.in_progress = False
+            self.completed = True
+            self.save()
+            return
         search_dictionary = split_terms(self.search_term)
-        search_query = SearchQuery(self.search_term, search_type='websearch')
-        files = files.filter(
-            file_contents__search_vector=search_query
-        ).annotate(
-            headline=SearchHeadline(
-                'file_contents__content', search_query, start_sel="<b>", stop_sel="</b>", highlight_all=True)
-        ).distinct()
-        print(files)
-        term_headline_file_dict = {}
-        found_terms = []
-        results = []
-        for f in files:
-            if f.id not in term_headline_file_dict:
-                print(f.id)
-                term_headline_file_dict[f.id] = {'file': f, 'term_contexts': {}}
-            term_contexts = f.get_search_items_from_headline(search_dictionary)
-            for t in term_contexts:
-                term = t.lower()
-                if term not in term_headline_file_dict[f.id]['term_contexts']:
-                    term_headline_file_dict[f.id]['term_contexts'][term] = []
-                term_headline_file_dict[f.id]['term_contexts'][term].extend(term_contexts[t])
-                if term not in found_terms:
-                    found_terms.append(term)
-        channel_layer = get_channel_layer()
+        if self.search_mode in IDENTIFIER_SEARCH_MODES:
+            files = self.prune_files(files, search_dictionary)
+            term_headline_file_dict = self.search_identifier_index(files, search_dictionary)
+        else:
+            term_headline_file_dict = self.search_full_text(files, search_dictionary)
         count_found_files = len([f for f in term_headline_file_dict])
-        current_progress = 0
-        async_to_sync(channel_layer.group_send)(
-            f"search_{self.session_id}", {
-                "type": "search_message", "message": {
-                    "type": "search_status",
-                    "status": "in_progress",
-                    "id": self.id,
-                    "found_files": count_found_files,
-                    "current_progress": current_progress,
-                }})
-
-        primary_id_analysis_group_result_map = {}
+
+        def send_progress(current_progress, result_count):
+            reporter.progress(
+                current_progress / count_found_files * 100 if count_found_files else None,
+                found_files=count_found_files, current_progress=current_progress, result_count=result_count
+            )
+
+        send_progress(0, 0)
+
+        # the results of an analysis group only depend on the files of that group so groups are searched one at a time,
+        # cheapest first, and their results are saved as soon as the group is done
+        finished_files = 0
+        result_count = 0
+        spent = 0
+        for analysis_group_id, matched_files, cost in self.plan_search(term_headline_file_dict):
+            if settings.SEARCH_WORK_BUDGET and finished_files and spent + cost > settings.SEARCH_WORK_BUDGET:
+                self.partial = True
+                break
+            if self.is_cancelled():
+                self.partial = True
+                break
+            spent += cost
+            # matched files are extracted in the search pool and merged in the order they were found so that the
+            # results do not depend on which file finishes first. Files that have not started when the search is
+            # cancelled are skipped and the results found so far are still saved.
+            file_results = run_tasks(
+                lambda f: [] if self.is_cancelled() else list(self.extract_result(f, term_headline_file_dict[f]['term_contexts'], term_headline_file_dict)),
+                matched_files, settings.SEARCH_WORKERS, lambda done: send_progress(finished_files + done, result_count)
+            )
+            primary_id_analysis_group_result_map = {}
+            # primary ids matched in each file of the group keyed by file id
+            matched_primary_ids = {}
+            for f, results_in_file in zip(matched_files, file_results):
+                pi_set = set()
+                for result in results_in_file:
+                    pi_set.add(result.primary_id)
+                    if result.primary_id not in primary_id_analysis_group_result_map:
+                        primary_id_analysis_group_result_map[result.primary_id] = {}
+                    if result.file.analysis_group.id not in primary_id_analysis_group_result_map[result.primary_id]:
+                        primary_id_analysis_group_result_map[result.primary_id][result.file.analysis_group.id] = {}
+                    if result.comparison_label not in primary_id_analysis_group_result_map[result.primary_id][result.file.analysis_group.id]:
+                        primary_id_analysis_group_result_map[result.primary_id][result.file.analysis_group.id][result.comparison_label] = result
+                    else:
+                        primary_id_analysis_group_result_map[result.primary_id][result.file.analysis_group.id][result.comparison_label].search_term += f" or {result.search_term}"
+                matched_primary_ids[f] = pi_set
+            if analysis_group_id is not None:
+                self.enrich_related_results({analysis_group_id: matched_primary_ids}, primary_id_analysis_group_result_map)
+            saved = self.save_results(primary_id_analysis_group_result_map)
+            if saved and not result_count:
+                reporter.send("first_results", result_count=saved)
+            result_count += saved
+            finished_files += len(matched_files)
+            send_progress(finished_files, result_count)
+        reporter.flush()
+        if self.is_cancelled():
+            self.cancelled = True
+            self.partial = True
+        self.in_progress = False
+        self.completed = True
+        self.save()
+        # partial results depend on the budget or on when the search was cancelled, and results that left out files
+        # that were not indexed yet would be kept after the files are, so neither is reused by later searches
+        if not self.partial and complete:
+            cache.set(cache_key, self.id, settings.SEARCH_RESULT_CACHE_TIMEOUT)
+
+    def plan_search(self, term_headline_file_dict) -> List[tuple]:
+        """
+        Group the matched files by analysis group and order the groups by their estimated cost, the number of rows the
+        search will read. Every hit row is read from the matched file and the related files of its group hold about as
+        many rows for the same primary ids, so a group costs its hit count times its number of files. Groups with the
+        same cost are ordered by hit count, the larger first, then by id. Returns (analysis group id, file ids, cost).
+        """
+        analysis_group_files = {}
         for f in term_headline_file_dict:
-            related_files = term_headline_file_dict[f]['file'].analysis_group.project_files.all().exclude(id=f)
-            result_in_file = []
-            pi_list = []
-            async_to_sync(channel_layer.group_send)(
-                f"search_{self.session_id}", {
-                    "type": "search_message", "message": {
-                        "type": "search_status",
-                        "status": "in_progress",
-                        "id": self.id,
-                        "found_files": count_found_files,
-                        "current_progress": current_progress+1,
-                    }})
-            term_contexts = term_headline_file_dict[f]['term_contexts']
-            for result in self.extract_result(f, term_contexts, term_headline_file_dict):
-                if result.primary_id not in pi_list:
-                    pi_list.append(result.primary_id)
-                if result.primary_id not in primary_id_analysis_group_result_map:
-                    primary_id_analysis_group_result_map[result.primary_id] = {}
-                if result.file.analysis_group.id not in primary_id_analysis_group_result_map[result.primary_id]:
-                    primary_id_analysis_group_result_map[result.primary_id][result.file.analysis_group.id] = {}
-                if result.comparison_label not in primary_id_analysis_group_result_map[result.primary_id][result.file.analysis_group.id]:
-                    primary_id_analysis_group_result_map[result.primary_id][result.file.analysis_group.id][result.comparison_label] = result
-                else:
-                    primary_id_analysis_group_result_map[result.primary_id][result.file.analysis_group.id][result.comparison_label].search_term += f" or {result.search_term}"
-            for related in related_files:
-                with related.file.open('rt') as infile:
-                    first_line_of_file = infile.readline()
-                    first_line_header = csv.reader([first_line_of_file], delimiter=related.get_delimiter())
-                    column_headers_map = {h: i for i, h in enumerate(next(first_line_header))}
-                    if related.extra_data:
-                        extra_data = json.loads(related.extra_data)
-                        if "primary_id_col" in extra_data:
-                            primary_id_col_index = column_headers_map[extra_data["primary_id_col"]]
-                            for line in infile:
-                                line_data = next(csv.reader([line], delimiter=related.get_delimiter()))
-                                primary_id = line_data[primary_id_col_index]
-                                if primary_id in pi_list:
-                                    if related.file_category == "searched":
-                                        gene_name = ""
-                                        uniprot_id = ""
-                                        if "gene_name_col" in extra_data:
-                                            if extra_data["gene_name_col"]:
-                                                gene_name_col_index = column_headers_map[extra_data["gene_name_col"]]
-                                                gene_name = line_data[gene_name_col_index]
-                                        if "uniprot_id_col" in extra_data:
-                                            if extra_data["uniprot_id_col"]:
-                                                uniprot_col_index = column_headers_map[extra_data["uniprot_id_col"]]
-                                                uniprot_id = line_data[uniprot_col_index]
-                                        searched_data = []
-                                        sample_annotation = SampleAnnotation.objects.filter(file=related).first()
-                                        if sample_annotation:
-                                            annotation = json.loads(sample_annotation.annotations)
-                                            for a in annotation:
-                                                if a["Sample"] in column_headers_map:
-                                                    sample_col_index = column_headers_map[a["Sample"]]
-                                                    if line_data[sample_col_index] != "":
-                                                        searched_data.append({"Sample": a["Sample"], "Condition": a["Condition"],
-                                                                          "Value": float(line_data[sample_col_index])})
-                                                    else:
-                                                        searched_data.append({"Sample": a["Sample"], "Condition": a["Condition"],
-                                                                          "Value": None})
-                                        search_result = SearchResult(
-                                            search_term="",
-                                            file=related,
-                                            session=self,
-                                            analysis_group=related.analysis_group,
-                                            gene_name=gene_name,
-                                            uniprot_id=uniprot_id,
-                                            primary_id=primary_id,
-                                            searched_data=json.dumps(searched_data).replace("NaN", "null")
-                                        )
-                                        if primary_id in primary_id_analysis_group_result_map:
-                                            if related.analysis_group.id in primary_id_analysis_group_result_map[primary_id]:
-                                                for comparison_label in primary_id_analysis_group_result_map[primary_id][related.analysis_group.id]:
-                                                    primary_id_analysis_group_result_map[primary_id][related.analysis_group.id][comparison_label].searched_data = search_result.searched_data
-
-                                        #result_in_file.append(search_result)
-                                    elif related.file_category == "df":
-                                        comparison_matrix = ComparisonMatrix.objects.filter(file=related).first()
-                                        ptm_data = {}
-                                        for i in ["modification_position_in_protein_col",
-                                                  "modification_position_in_peptide_col",
-                                                  "localization_prob_col", "peptide_seq_col"]:
-                                            if i in extra_data:
-                                                if line_data[column_headers_map[extra_data[i]]] != "":
-                                                    ptm_data[i] = line_data[column_headers_map[extra_data[i]]]
-                                                    if i == "localization_prob_col":
-                                                        if ptm_data[i]:
-                                                            ptm_data[i] = float(ptm_data[i])
-                                                        else:
-                                                            ptm_data[i] = None
-                                                    else:
-                                                        ptm_data[i] = line_data[column_headers_map[extra_data[i]]]
-
-                                        if comparison_matrix.matrix:
-                                            matrix = json.loads(comparison_matrix.matrix)
-                                            for m in matrix:
-                                                log2_fc = None
-                                                log10_p = None
-                                                if line_data[column_headers_map[m["fold_change_col"]]] != "":
-                                                    log2_fc = float(line_data[column_headers_map[m["fold_change_col"]]])
-                                                if line_data[column_headers_map[m["p_value_col"]]] != "":
-                                                    log10_p = float(line_data[column_headers_map[m["p_value_col"]]])
-                                                if log2_fc and log10_p:
-                                                    if self.apply_fc_pvalue_filter(log2_fc, log10_p):
-                                                        sr = SearchResult(
-                                                            search_term="",
-                                                            file=related,
-                                                            session=self,
-                                                            analysis_group=related.analysis_group,
-                                                            condition_A=m["condition_A"],
-                                                            condition_B=m["condition_B"],
-                                                            log2_fc=log2_fc,
-                                                            log10_p=log10_p,
-                                                        )
-                                                        if ptm_data:
-                                                            sr.ptm_data = json.dumps(ptm_data)
-                                                        if "comparison_col" in m:
-                                                            if m["comparison_col"] in column_headers_map:
-                                                                sr.comparison_label = line_data[column_headers_map[m["comparison_col"]]]
-                                                                if m["comparison_label"]:
-                                                                    sr.comparison_label += f"({m['comparison_label']})"
-                                                            else:
-                                                                sr.comparison_label = m["comparison_label"]
-                                                        else:
-                                                            sr.comparison_label = m["comparison_label"]
-                                                        if primary_id in primary_id_analysis_group_result_map:
-                                                            if related.analysis_group.id in primary_id_analysis_group_result_map[primary_id]:
-                                                                if sr.comparison_label in primary_id_analysis_group_result_map[primary_id][related.analysis_group.id]:
-                                                                    primary_id_analysis_group_result_map[primary_id][related.analysis_group.id][sr.comparison_label].log2_fc = sr.log2_fc
-                                                                    primary_id_analysis_group_result_map[primary_id][related.analysis_group.id][sr.comparison_label].log10_p = sr.log10_p
-                                                                    primary_id_analysis_group_result_map[primary_id][related.analysis_group.id][sr.comparison_label].comparison_label = sr.comparison_label
-                                                                    primary_id_analysis_group_result_map[primary_id][related.analysis_group.id][sr.comparison_label].condition_A = sr.condition_A
-                                                                    primary_id_analysis_group_result_map[primary_id][related.analysis_group.id][sr.comparison_label].condition_B = sr.condition_B
-                                                                    primary_id_analysis_group_result_map[primary_id][related.analysis_group.id][sr.comparison_label].ptm_data = sr.ptm_data
-                                                                else:
-                                                                    primary_id_analysis_group_result_map[primary_id][related.analysis_group.id][sr.comparison_label] = sr
-
-
-                                                        #result_in_file.append(sr)
-
-                                    elif related.file_category == "copy_number":
-                                        if "copy_number_col" in extra_data and "rank_col" in extra_data:
-                                            copy_number_col_index = column_headers_map[extra_data["copy_number_col"]]
-                                            rank_col_index = column_headers_map[extra_data["rank_col"]]
-                                            copy_number = float(line_data[copy_number_col_index])
-                                            rank = int(line_data[rank_col_index])
-                                            sr = SearchResult(
-                                                search_term="",
-                                                file=related,
-                                                session=self,
-                                                analysis_group=related.analysis_group,
-                                                copy_number=copy_number,
-                                                rank=rank,
-                                            )
-                                            if primary_id in primary_id_analysis_group_result_map:
-                                                if related.analysis_group.id in primary_id_analysis_group_result_map[primary_id]:
-                                                    for comparison_label in primary_id_analysis_group_result_map[primary_id][related.analysis_group.id]:
-                                                        primary_id_analysis_group_result_map[primary_id][related.analysis_group.id][comparison_label].copy_number = sr.copy_number
-                                                        primary_id_analysis_group_result_map[primary_id][related.analysis_group.id][comparison_label].rank = sr.rank
-                                            #result_in_file.append(sr)
-
-            current_progress += 1
-            #results.extend(result_in_file)
+            analysis_group_files.setdefault(term_headline_file_dict[f]['file'].analysis_group_id, []).append(f)
+        group_sizes = dict(
+            ProjectFile.objects.filter(analysis_group__in=[g for g in analysis_group_files if g is not None], index_status="ready")
+            .values_list("analysis_group").annotate(count=models.Count("id"))
+        )
+        plan = []
+        for analysis_group_id, matched_files in analysis_group_files.items():
+            hits = sum(len(term_headline_file_dict[f]['index_hits']) for f in matched_files)
+            file_count = max(group_sizes.get(analysis_group_id, 0), len(matched_files))
+            # files with fewer hits are read first within a group
+            matched_files.sort(key=lambda f: (len(term_headline_file_dict[f]['index_hits']), f))
+            plan.append((analysis_group_id, matched_files, hits * file_count, hits))
+        plan.sort(key=lambda p: (p[2], -p[3], p[0] is None, p[0] or 0))
+        return [(analysis_group_id, matched_files, cost) for analysis_group_id, matched_files, cost, hits in plan]
+
+    def get_cache_key(self, files) -> str:
+        """
+        Build the result cache key of the session from its normalized query, thresholds and, for every file the search
+        can read, that is the searched files and the other files of their analysis groups, the content hash, the
+        extra_data column mapping and the comparison matrices and sample annotations. A file whose content or settings
+        change gets a new key so only the entries that involve it stop matching.
+        """
+        involved_files = self.get_involved_files(files)
+        matrices = ComparisonMatrix.objects.filter(file__in=involved_files).order_by("id").values_list("file_id", "matrix")
+        annotations = SampleAnnotation.objects.filter(file__in=involved_files).order_by("id").values_list("file_id", "annotations")
+        descriptor = {
+            "terms": sorted({t for subterms in split_terms(self.search_term).values() for t in subterms if t}),
+            "search_mode": self.search_mode,
+            "match_type": self.match_type,
+            "log2_fc": self.log2_fc,
+            "log10_p_value": self.log10_p_value,
+            "species": self.species_id,
+            "analysis_groups": sorted(self.analysis_groups.values_list("id", flat=True)),
+            "files": list(involved_files.order_by("id").values_list("id", "hash", "extra_data", "file_category", "load_file_content")),
+            "comparison_matrices": list(matrices),
+            "sample_annotations": list(annotations),
+        }
+        return "search_results_" + hashlib.sha256(json.dumps(descriptor).encode()).hexdigest()
+
+    def get_involved_files(self, files):
+        """
+        Return the files a search over the given files can read, the files themselves and the other files of their
+        analysis groups
+        """
+        return ProjectFile.objects.filter(Q(id__in=files.values("id")) | Q(analysis_group__in=files.values("analysis_group")))
+
+    def all_files_indexed(self, files) -> bool:
+        """
+        Return whether every file a search over the given files can read is ready and indexed for the search mode.
+        Files that are not are left out of the search, or of the related results, so its results are incomplete.
+        """
+        return not self.get_involved_files(files).filter(~Q(index_status="ready") | Q(identifier_indexed=False)).exists()
+
+    def copy_results_from(self, session_id: int) -> int:
+        """
+        Copy the results of a previous session with the same cache key into this session and return the number copied
+        """
+        fields = [f.attname for f in SearchResult._meta.concrete_fields if f.name not in ["id", "created_at", "updated_at", "session"]]
+        batch = []
+        count = 0
+        for values in SearchResult.objects.filter(session_id=session_id).order_by("id").values(*fields).iterator(chunk_size=settings.SEARCH_RESULT_BATCH_SIZE):
+            batch.append(SearchResult(session=self, **values))
+            if len(batch) >= settings.SEARCH_RESULT_BATCH_SIZE:
+                SearchResult.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            SearchResult.objects.bulk_create(batch)
+            count += len(batch)
+        return count
+
+    def save_results(self, primary_id_analysis_group_result_map: dict) -> int:
+        """
+        Write the results of a result map in batches of SEARCH_RESULT_BATCH_SIZE and return the number written
+        """
+        results = []
         for primary_id in primary_id_analysis_group_result_map:
             for analysis_group_id in primary_id_analysis_group_result_map[primary_id]:
                 for comparison_label in primary_id_analysis_group_result_map[primary_id][analysis_group_id]:
                     results.append(primary_id_analysis_group_result_map[primary_id][analysis_group_id][comparison_label])
-        SearchResult.objects.bulk_create(results)
-        self.in_progress = False
-        self.completed = True
-        self.save()
+        SearchResult.objects.bulk_create(results, batch_size=settings.SEARCH_RESULT_BATCH_SIZE)
+        return len(results)
+
+    def enrich_related_results(self, analysis_group_primary_ids: Dict[int, Dict[int, set]], primary_id_analysis_group_result_map: dict):
+        """
+        Fill the results of the matched files with the values found for the same primary ids in the other files of their
+        analysis group. Each file of the groups is read once with the primary ids matched in every other file of its group
+        and its sample annotation and comparison matrix are loaded up front. Files are read in the search pool and their
+        values are applied in file order.
+        """
+        related_files = list(ProjectFile.objects.filter(analysis_group_id__in=analysis_group_primary_ids.keys(), index_status="ready").select_related("analysis_group"))
+        sample_annotations = first_by_file(SampleAnnotation.objects.filter(file__in=related_files))
+        comparison_matrices = first_by_file(ComparisonMatrix.objects.filter(file__in=related_files))
+        tasks = []
+        for related in related_files:
+            pi_set = set()
+            for file_id, primary_ids in analysis_group_primary_ids[related.analysis_group_id].items():
+                if file_id != related.id:
+                    pi_set |= primary_ids
+            if pi_set:
+                tasks.append((related, pi_set, sample_annotations.get(related.id), comparison_matrices.get(related.id)))
+        updates = run_tasks(lambda task: [] if self.is_cancelled() else self.read_related_file(*task), tasks, settings.SEARCH_WORKERS)
+        for (related, *_), related_updates in zip(tasks, updates):
+            self.apply_related_updates(related, related_updates, primary_id_analysis_group_result_map)
+
+    def read_related_file(self, related: ProjectFile, pi_set: set, sample_annotation: Optional[SampleAnnotation], comparison_matrix: Optional[ComparisonMatrix]) -> List[tuple]:
+        """
+        Read the values of the rows of a related file holding the given primary ids. Returns a list of
+        ("searched_data", primary id, searched data), ("comparison", primary id, SearchResult) and
+        ("copy_number", primary id, copy number, rank) updates.
+        """
+        updates = []
+        if not related.extra_data:
+            return updates
+        extra_data = json.loads(related.extra_data)
+        if not extra_data.get("primary_id_col"):
+            return updates
+        rows = related.get_row_numbers_for_primary_ids(pi_set)
+        if not rows:
+            return updates
+        primary_ids = related.read_columns([extra_data["primary_id_col"]], rows).get(extra_data["primary_id_col"], [])
+        if related.file_category == "searched":
+            annotation = json.loads(sample_annotation.annotations) if sample_annotation else []
+            intensities = related.read_numeric_columns([a["Sample"] for a in annotation], rows)
+            for i, primary_id in enumerate(primary_ids):
+                if primary_id not in pi_set:
+                    continue
+                searched_data = []
+                for a in annotation:
+                    if a["Sample"] in intensities:
+                        searched_data.append({"Sample": a["Sample"], "Condition": a["Condition"],
+                                              "Value": float_or_none(intensities[a["Sample"]][i])})
+                updates.append(("searched_data", primary_id, json.dumps(searched_data).replace("NaN", "null")))
+
+        elif related.file_category == "df":
+            ptm_columns = {i: extra_data[i] for i in ["modification_position_in_protein_col",
+                                                      "modification_position_in_peptide_col",
+                                                      "localization_prob_col", "peptide_seq_col"] if extra_data.get(i)}
+            ptm_values = related.read_columns(list(ptm_columns.values()), rows)
+            matrix = []
+            if comparison_matrix and comparison_matrix.matrix:
+                matrix = json.loads(comparison_matrix.matrix)
+            values = related.read_numeric_columns([m[c] for m in matrix for c in ["fold_change_col", "p_value_col"]], rows)
+            labels = related.read_columns([m["comparison_col"] for m in matrix if m.get("comparison_col")], rows)
+            log2_fc, log10_p, passed = self.comparison_matrix_mask(values, matrix, len(primary_ids))
+            ptm_data_rows = {}
+            for i, j in zip(*np.nonzero(passed)):
+                primary_id = primary_ids[i]
+                if primary_id not in pi_set:
+                    continue
+                if i not in ptm_data_rows:
+                    ptm_data = {}
+                    for key, column in ptm_columns.items():
+                        if column in ptm_values and ptm_values[column][i] != "":
+                            if key == "localization_prob_col":
+                                ptm_data[key] = float(ptm_values[column][i])
+                            else:
+                                ptm_data[key] = ptm_values[column][i]
+                    ptm_data_rows[i] = ptm_data
+                ptm_data = ptm_data_rows[i]
+                m = matrix[j]
+                sr = SearchResult(
+                    search_term="",
+                    file=related,
+                    session=self,
+                    analysis_group=related.analysis_group,
+                    condition_A=m["condition_A"],
+                    condition_B=m["condition_B"],
+                    log2_fc=float(log2_fc[i, j]),
+                    log10_p=float(log10_p[i, j]),
+                )
+                if ptm_data:
+                    sr.ptm_data = json.dumps(ptm_data)
+                if m.get("comparison_col") in labels:
+                    sr.comparison_label = labels[m["comparison_col"]][i]
+                    if m["comparison_label"]:
+                        sr.comparison_label += f"({m['comparison_label']})"
+                else:
+                    sr.comparison_label = m["comparison_label"]
+                updates.append(("comparison", primary_id, sr))
+
+        elif related.file_category == "copy_number":
+            if "copy_number_col" in extra_data and "rank_col" in extra_data:
+                numbers = related.read_numeric_columns([extra_data["copy_number_col"], extra_data["rank_col"]], rows)
+                for i, primary_id in enumerate(primary_ids):
+                    if primary_id not in pi_set:
+                        continue
+                    rank = float_or_none(numbers[extra_data["rank_col"]][i])
+                    if rank is not None:
+                        rank = int(rank)
+                    updates.append(("copy_number", primary_id, float_or_none(numbers[extra_data["copy_number_col"]][i]), rank))
+        return updates
+
+    def apply_related_updates(self, related: ProjectFile, updates: List[tuple], primary_id_analysis_group_result_map: dict):
+        for update in updates:
+            primary_id = update[1]
+            if primary_id not in primary_id_analysis_group_result_map:
+                continue
+            if related.analysis_group.id not in primary_id_analysis_group_result_map[primary_id]:
+                continue
+            group_results = primary_id_analysis_group_result_map[primary_id][related.analysis_group.id]
+            if update[0] == "searched_data":
+                for comparison_label in group_results:
+                    group_results[comparison_label].searched_data = update[2]
+            elif update[0] == "comparison":
+                sr = update[2]
+                if sr.comparison_label in group_results:
+                    group_results[sr.comparison_label].log2_fc = sr.log2_fc
+                    group_results[sr.comparison_label].log10_p = sr.log10_p
+                    group_results[sr.comparison_label].comparison_label = sr.comparison_label
+                    group_results[sr.comparison_label].condition_A = sr.condition_A
+                    group_results[sr.comparison_label].condition_B = sr.condition_B
+                    group_results[sr.comparison_label].ptm_data = sr.ptm_data
+                else:
+                    group_results[sr.comparison_label] = sr
+            elif update[0] == "copy_number":
+                for comparison_label in group_results:
+                    group_results[comparison_label].copy_number = update[2]
+                    group_results[comparison_label].rank = update[3]
+
+    def search_full_text(self, files, search_dictionary):
+        """
+        Look up the search terms in every identifier column of the files that are included in full text search. The
+        terms are matched with the match type of the session the same way as in the identifier search modes.
+        """
+        return self.search_identifier_index(files.filter(load_file_content=True), search_dictionary, list(IDENTIFIER_SEARCH_MODES))
+
+    def prune_files(self, files, search_dictionary):
+        """
+        Leave out the files whose identifier bloom filter shows that they cannot hold any of the search terms. Only the
+        exact and isoform match types can be checked this way, files without a bloom filter are always kept.
+        """
+        if self.match_type not in ("exact", "isoform"):
+            return files
+        terms = {t for subterms in search_dictionary.values() for t in subterms if t}
+        if self.match_type == "isoform":
+            keys = [f"{self.search_mode}~{isoform_base(t)}" for t in terms]
+        else:
+            keys = [f"{self.search_mode}:{t}" for t in terms]
+        kept = []
+        for file_id, data in files.values_list("id", "identifier_bloom"):
+            if data is None or BloomFilter.from_bytes(bytes(data)).might_contain_any(keys):
+                kept.append(file_id)
+        return files.filter(id__in=kept)
+
+    def search_identifier_index(self, files, search_dictionary, column_types: List[str] = None):
+        """
+        Look up the search terms directly in the identifier index of the files, in the column of the search mode or in
+        the given column types
+        """
+        terms = {t for subterms in search_dictionary.values() for t in subterms if t}
+        # files without an identifier index are indexed by the ingest worker rather than by the search and left out
+        # until then
+        for f in files.filter(identifier_indexed=False):
+            f.queue_processing(from_status="ready")
+        files = files.filter(identifier_indexed=True)
+        hits = sorted(self.get_identifier_hits(files, terms, column_types or [self.search_mode]), key=lambda h: (h[0], h[2]))
+        term_headline_file_dict = {}
+        for file_id, term, row in hits:
+            if file_id not in term_headline_file_dict:
+                term_headline_file_dict[file_id] = {'file': None, 'term_contexts': {}, 'index_hits': []}
+            term_headline_file_dict[file_id]['term_contexts'].setdefault(term, [])
+            term_headline_file_dict[file_id]['index_hits'].append((row, term))
+        for f in ProjectFile.objects.filter(id__in=term_headline_file_dict.keys()):
+            term_headline_file_dict[f.id]['file'] = f
+        return term_headline_file_dict
+
+    def get_identifier_hits(self, files, terms, column_types: List[str]):
+        """
+        Yield (file id, term, row) for every identifier of the given column types matching a search term with
+        the match type of the session. exact compares whole identifiers. The other match types first expand each term
+        into the identifiers of the file it matches using the sorted identifiers of the columns: isoform ignores the
+        isoform suffix, prefix matches identifiers starting with the term and fuzzy matches identifiers with a trigram
+        similarity of at least SEARCH_FUZZY_THRESHOLD, with the trigrams of the identifiers of a column computed once
+        for all the terms. The rows of the expanded identifiers are then read from the identifier index. Files sharing
+        an index are looked up once.
+        """
+        identifiers = ProjectFileIdentifier.objects.filter(column_type__in=column_types)
+        key_files = {}
+        for f in files:
+            key_files.setdefault(f.get_identifier_key(), []).append(f)
+        if self.match_type not in ("isoform", "prefix", "fuzzy"):
+            for key, value, row in identifiers.filter(content_key__in=key_files, value__in=terms).values_list('content_key', 'value', 'row'):
+                for f in key_files[key]:
+                    yield f.id, value, row
+            return
+        for key, shared_files in key_files.items():
+            value_terms = {}
+            for column_type in column_types:
+                vocabulary = shared_files[0].get_identifier_vocabulary(column_type)
+                trigrams = file_index.trigram_index(vocabulary) if self.match_type == "fuzzy" else None
+                for term in terms:
+                    if self.match_type == "isoform":
+                        base = isoform_base(term)
+                        values = [v for v in file_index.prefix_matches(vocabulary, base) if isoform_base(v) == base]
+                    elif self.match_type == "prefix":
+                        values = file_index.prefix_matches(vocabulary, term)
+                    else:
+                        values = file_index.fuzzy_matches(vocabulary, term, settings.SEARCH_FUZZY_THRESHOLD, trigrams)
+                    for value in values:
+                        value_terms.setdefault(value, []).append(term)
+            if not value_terms:
+                continue
+            value_terms = {value: list(dict.fromkeys(t)) for value, t in value_terms.items()}
+            for value, row in identifiers.filter(content_key=key, value__in=value_terms).values_list('value', 'row'):
+                for term in value_terms[value]:
+                    for f in shared_files:
+                        yield f.id, term, row
 
     def extract_result(self, f, term_contexts, term_headline_file_dict):
         if term_contexts:
             file = term_headline_file_dict[f]['file']
-            search_result_dict = {}
-            # for term in term_contexts:
-            #
-            #     if term not in search_result_dict:
-            #
-            #         search_result = SearchResult.objects.create(search_term=term,
-            #                                                 #headline_results=json.dumps(list(set(term_contexts[term]))),
-            #                                                 file=file,
-            #                                                 session=self,
-            #                                                 analysis_group=file.analysis_group
-            #                                                 )
-            #         search_result_dict[term] = search_result
-
-            line_term_already_found = {term: [] for term in term_contexts}
-            first_line_of_file = ""
-            column_headers_map = {}
-            with file.file.open('rt') as infile:
-                first_line_of_file = infile.readline()
-                first_line_header = csv.reader([first_line_of_file], delimiter=file.get_delimiter())
-                column_headers_map = {h: i for i, h in enumerate(next(first_line_header))}
-            for result in self.get_contexts(file, term_contexts):
-                found_term = result["term"].lower()
-                if file.extra_data:
-                    extra_data = json.loads(file.extra_data)
-                    for search_result in self.extract_result_data(column_headers_map, file, found_term, result):
-                        gene_name = ""
-                        primary_id = ""
-                        uniprot_id = ""
-                        if "gene_name_col" in extra_data:
-                            if extra_data["gene_name_col"]:
-                                gene_name_col_index = column_headers_map[extra_data["gene_name_col"]]
-                                gene_name = result["context"][gene_name_col_index]
-                        if "primary_id_col" in extra_data:
-                            if extra_data["primary_id_col"]:
-                                primary_id_col_index = column_headers_map[extra_data["primary_id_col"]]
-                                primary_id = result["context"][primary_id_col_index]
-                        if "uniprot_id_col" in extra_data:
-                            if extra_data["uniprot_id_col"]:
-                                uniprot_col_index = column_headers_map[extra_data["uniprot_id_col"]]
-                                uniprot_id = result["context"][uniprot_col_index]
-                        search_result.gene_name = gene_name
-                        search_result.primary_id = primary_id
-                        search_result.uniprot_id = uniprot_id
-                        if self.search_mode == "gene":
-                            if "gene_name_col" in extra_data:
-                                if gene_name:
-                                    if found_term in gene_name.lower():
-                                        yield search_result
-
-                        elif self.search_mode == "uniprot":
-                            if "uniprot_col" in extra_data:
-                                if uniprot_id:
-                                    if found_term in uniprot_id.lower():
-                                        yield search_result
-                        elif self.search_mode == "pi":
-                            if "primary_id_col" in extra_data:
-                                if primary_id:
-                                    if found_term in primary_id.lower():
-                                        yield search_result
-                        else:
-                            yield search_result
-
-
-    def extract_result_data(self, column_headers_map, file, found_term, result):
+            if not file.extra_data:
+                return
+            extra_data = json.loads(file.extra_data)
+            hits = list(self.get_contexts(file, term_contexts, term_headline_file_dict[f]['index_hits']))
+            if not hits:
+                return
+            identifier_columns = {}
+            for column_key, attribute in [("gene_name_col", "gene_name"), ("primary_id_col", "primary_id"), ("uniprot_id_col", "uniprot_id")]:
+                if extra_data.get(column_key):
+                    identifier_columns[attribute] = extra_data[column_key]
+            identifiers = file.read_columns(list(identifier_columns.values()), [h["row"] for h in hits])
+            for i, search_result in self.extract_result_data(file, hits):
+                for attribute in ["gene_name", "primary_id", "uniprot_id"]:
+                    column = identifier_columns.get(attribute)
+                    setattr(search_result, attribute, identifiers[column][i] if column in identifiers else "")
+                # identifier search modes are answered from the identifier index so the row is already
+                # known to hold the term in the requested column
+                yield search_result
+
+
+    def extract_result_data(self, file, hits):
+        """
+        Yield (hit position, SearchResult) for the hits of a file. Only the columns needed for the results are read from
+        the column store of the file.
+        """
+        rows = [h["row"] for h in hits]
         if file.file_category == "df":
             comparison_matrix = ComparisonMatrix.objects.filter(file=file).first()
             if comparison_matrix:
                 if comparison_matrix.matrix:
                     matrix = json.loads(comparison_matrix.matrix)
-                    for m in matrix:
-                        log2_fc = None
-                        if result["context"][column_headers_map[m["fold_change_col"]]] != "":
-                            log2_fc = float(result["context"][column_headers_map[m["fold_change_col"]]])
-                        log10_p = None
-                        if result["context"][column_headers_map[m["p_value_col"]]] != "":
-                            log10_p = float(result["context"][column_headers_map[m["p_value_col"]]])
-                        if log2_fc and log10_p:
-                            if self.apply_fc_pvalue_filter(log2_fc, log10_p):
-                                sr = SearchResult(
-                                    search_term=found_term,
-                                    file=file,
-                                    session=self,
-                                    analysis_group=file.analysis_group,
-                                    condition_A=m["condition_A"],
-                                    condition_B=m["condition_B"],
-                                    log2_fc=log2_fc,
-                                    log10_p=log10_p,
-                                )
-                                if "comparison_col" in m:
-                                    if m["comparison_col"] in column_headers_map:
-                                        label = result["context"][column_headers_map[m["comparison_col"]]]
-                                        if m["comparison_label"]:
-                                            if label == m['comparison_label']:
-                                                sr.comparison_label = m['comparison_label']
-
-                                    else:
-                                        sr.comparison_label = m["comparison_label"]
-                                else:
-                                    sr.comparison_label = m["comparison_label"]
-                                if sr.comparison_label:
-                                    if len(sr.comparison_label) > 0:
-                                        yield sr
+                    values = file.read_numeric_columns([m[c] for m in matrix for c in ["fold_change_col", "p_value_col"]], rows)
+                    labels = file.read_columns([m["comparison_col"] for m in matrix if m.get("comparison_col")], rows)
+                    log2_fc, log10_p, passed = self.comparison_matrix_mask(values, matrix, len(hits))
+                    # np.nonzero walks the mask row by row so results keep the hit order then the matrix order
+                    for i, j in zip(*np.nonzero(passed)):
+                        m = matrix[j]
+                        sr = SearchResult(
+                            search_term=hits[i]["term"].lower(),
+                            file=file,
+                            session=self,
+                            analysis_group=file.analysis_group,
+                            condition_A=m["condition_A"],
+                            condition_B=m["condition_B"],
+                            log2_fc=float(log2_fc[i, j]),
+                            log10_p=float(log10_p[i, j]),
+                        )
+                        if m.get("comparison_col") in labels:
+                            label = labels[m["comparison_col"]][i]
+                            if m["comparison_label"]:
+                                if label == m['comparison_label']:
+                                    sr.comparison_label = m['comparison_label']
+                        else:
+                            sr.comparison_label = m["comparison_label"]
+                        if sr.comparison_label:
+                            yield i, sr
             else:
                 print("no comparison matrix")
         else:
-            sr = SearchResult(
-                search_term=found_term,
-                file=file,
-                session=self,
-                analysis_group=file.analysis_group,
-            )
             sample_annotation = SampleAnnotation.objects.filter(file=file).first()
             if sample_annotation:
                 annotation = json.loads(sample_annotation.annotations)
-                searched_data = []
-                for a in annotation:
-
-                    if a["Sample"] in column_headers_map:
-                        sample_col_index = column_headers_map[a["Sample"]]
-                        if result["context"][sample_col_index] != "":
-                            searched_data.append({"Sample": a["Sample"], "Condition": a["Condition"],
-                                                  "Value": float(result["context"][sample_col_index])})
-                        else:
+                intensities = file.read_numeric_columns([a["Sample"] for a in annotation], rows)
+                for i, hit in enumerate(hits):
+                    searched_data = []
+                    for a in annotation:
+                        if a["Sample"] in intensities:
                             searched_data.append({"Sample": a["Sample"], "Condition": a["Condition"],
-                                                  "Value": None})
-                if searched_data and len(searched_data) > 0:
-                    sr.searched_data = json.dumps(searched_data).replace("NaN", "null")
-                    yield sr
-
-    def get_contexts(self, file: ProjectFile, term_contexts: Dict[str, List[str]]):
-        with file.file.open('rt') as infile:
-            if os.name == "nt":
-                for rid, line in enumerate(infile, 1):
-                    line = line.strip()
-                    if line:
-                        for t in term_contexts:
-                            match = re.search(r"(?<!\S)(?<!-|\w)(;)*{0}(?!\w)(?!\S)".format(t), line)
-                            if match:
-                                delimiter = file.get_delimiter()
-                                yield {"row": rid, "term": t, "context": next(csv.reader([line], delimiter=delimiter, quotechar='"'))}
-            else:
-                for t in self.search_file(file.file.path, term_contexts):
-                    # ignore header row
-                    if t["row"] > 1:
-                        row = t["row"]
-                        delimiter = file.get_delimiter()
-                        yield {"row": row, "term": t['term'], "context": next(csv.reader([t['context']], delimiter=delimiter, quotechar='"'))}
-
-    def apply_fc_pvalue_filter(self, log2_fc: float, log10_p: float):
-        return self.log2_fc <= abs(log2_fc) and log10_p >= self.log10_p_value
-
-
-    def search_file(self, filepath: str, terms: Dict[str, List[str]]):
+                                                  "Value": float_or_none(intensities[a["Sample"]][i])})
+                    if searched_data:
+                        sr = SearchResult(
+                            search_term=hit["term"].lower(),
+                            file=file,
+                            session=self,
+                            analysis_group=file.analysis_group,
+                            searched_data=json.dumps(searched_data).replace("NaN", "null"),
+                        )
+                        yield i, sr
+
+    def get_contexts(self, file: ProjectFile, term_contexts: Dict[str, List[str]], index_hits: List[tuple]):
+        """
+        Yield one {"row", "term"} record per term found in a data row of the file, ordered by row
         """
-        A function that use search.sh script from cephalon to search for terms in a file
+        row_terms = {}
+        for row, term in index_hits:
+            row_terms.setdefault(row, []).append(term)
+        for row in sorted(row_terms):
+            for term in dict.fromkeys(row_terms[row]):
+                yield {"row": row, "term": term}
+
+    def apply_fc_pvalue_filter(self, log2_fc: np.ndarray, log10_p: np.ndarray) -> np.ndarray:
         """
-        cephalon_path = os.path.dirname(cb.__file__)
-        search_sh_path = os.path.join(cephalon_path, "search.sh").replace("\\", "/")
-        filepath = filepath.replace('\\', '/')
+        Apply the fold change and p-value thresholds element-wise. Empty, NaN and zero cells never pass.
+        """
+        with np.errstate(invalid="ignore"):
+            return (log2_fc != 0) & (log10_p != 0) & (self.log2_fc <= np.abs(log2_fc)) & (log10_p >= self.log10_p_value)
 
-        result = subprocess.run(['bash', search_sh_path, ','.join(terms), filepath], capture_output=True)
-        data = result.stdout.decode("utf-8")
-        for i in data.split("\n"):
-            if i == "":
-                break
-            row = i.split(":")
-            yield {"term": row[0].strip(), "row": int(row[1].strip()), "context": row[2]}
+    def comparison_matrix_mask(self, values: Dict[str, np.ndarray], matrix: List[dict], row_count: int):
+        """
+        Stack the fold change and p-value columns of every comparison matrix entry into (rows, comparisons) arrays and
+        return them with the mask of the (row, comparison) pairs that pass the thresholds
+        """
+        missing = np.full(row_count, np.nan)
+        log2_fc = np.empty((row_count, len(matrix)))
+        log10_p = np.empty((row_count, len(matrix)))
+        for j, m in enumerate(matrix):
+            log2_fc[:, j] = values.get(m["fold_change_col"], missing)
+            log10_p[:, j] = values.get(m["p_value_col"], missing)
+        return log2_fc, log10_p, self.apply_fc_pvalue_filter(log2_fc, log10_p)
 
 
 class SearchResult(models.Model):
@@ -897,26 +1405,10 @@ class CurtainData(models.Model):
 
     def get_curtain_data(self, session_id=None):
         client = CurtainClient(self.host)
-        channel_layer = get_channel_layer()
-        if session_id:
-            async_to_sync(channel_layer.group_send)(
-                f"curtain_{session_id}", {
-                    "type": "curtain_message", "message": {
-                        "type": "curtain_status",
-                        "status": "in_progress",
-                        "id": self.id,
-                        "message": "Downloading data from Curtain"
-                    }})
+        reporter = ProgressReporter("curtain", session_id, type="curtain_status", id=self.id)
+        reporter.send("in_progress", message="Downloading data from Curtain")
         data = client.download_curtain_session(self.link_id)
-        if session_id:
-            async_to_sync(channel_layer.group_send)(
-                f"curtain_{session_id}", {
-                    "type": "curtain_message", "message": {
-                        "type": "curtain_status",
-                        "status": "in_progress",
-                        "id": self.id,
-                        "message": "Parsing data from Curtain"
-                    }})
+        reporter.send("in_progress", message="Parsing data from Curtain")
         differential_analysis_file = self.analysis_group.project_files.filter(file_category="df").first()
 
         if data["processed"]:
@@ -966,26 +1458,10 @@ class CurtainData(models.Model):
 
     def compose_analysis_group_from_curtain_data(self, analysis_group: AnalysisGroup, session_id=None):
         client = CurtainClient(self.host)
-        channel_layer = get_channel_layer()
-        if session_id:
-            async_to_sync(channel_layer.group_send)(
-                f"curtain_{session_id}", {
-                    "type": "curtain_message", "message": {
-                        "type": "curtain_status",
-                        "status": "in_progress",
-                        "id": self.id,
-                        "message": "Downloading data from Curtain"
-                    }})
+        reporter = ProgressReporter("curtain", session_id, type="curtain_status", id=self.id)
+        reporter.send("in_progress", message="Downloading data from Curtain")
         data = client.download_curtain_session(self.link_id)
-        if session_id:
-            async_to_sync(channel_layer.group_send)(
-                f"curtain_{session_id}", {
-                    "type": "curtain_message", "message": {
-                        "type": "curtain_status",
-                        "status": "in_progress",
-                        "id": self.id,
-                        "message": "Parsing data from Curtain"
-                    }})
+        reporter.send("in_progress", message="Parsing data from Curtain")
 
         try:
             sniffer = csv.Sniffer()
@@ -1062,9 +1538,11 @@ class CurtainData(models.Model):
             project=analysis_group.project,
             file=diff_file_path,
             load_file_content=True,
-            extra_data=json.dumps(diff_file_extra_data)
+            extra_data=json.dumps(diff_file_extra_data),
+            index_status="pending"
         )
-        diff_project_file.save_altered()
+        # hashing and indexing run in the ingest worker, the file is searchable once index_status is ready
+        diff_project_file.queue_processing(session_id)
         searched_file_extra_data = {
             "primary_id_col": data["rawForm"]["_primaryIDs"],
             "gene_name_col": None,
@@ -1079,9 +1557,10 @@ class CurtainData(models.Model):
             project=analysis_group.project,
             file=searched_file_path,
             load_file_content=True,
-            extra_data=json.dumps(searched_file_extra_data)
+            extra_data=json.dumps(searched_file_extra_data),
+            index_status="pending"
         )
-        searched_project_file.save_altered()
+        searched_project_file.queue_processing(session_id)
         annotations = []
         for s in data["rawForm"]["_samples"]:
             if "sampleMap" in data["settings"]:
@@ -1146,15 +1625,7 @@ class CurtainData(models.Model):
                 file=diff_project_file,
                 matrix=json.dumps(matrix)
             )
-        if session_id:
-            async_to_sync(channel_layer.group_send)(
-                f"curtain_{session_id}", {
-                    "type": "curtain_message", "message": {
-                        "type": "curtain_status",
-                        "status": "in_progress",
-                        "id": self.id,
-                        "message": "Creating Analysis Group"
-                    }})
+        reporter.send("in_progress", message="Creating Analysis Group")
         if data["differentialForm"]["_comparisonSelect"]:
             if data["differentialForm"]["_comparison"] != "CurtainSetComparison":
                 comparison_label = data["differentialForm"]["_comparisonSelect"]
@@ -1243,7 +1714,9 @@ class SourceFile(models.Model):
         app_label = 'cb'
 
     def delete(self, using=None, keep_parents=False):
-        if self.file:
+        # the same stored file can be referenced by several records, it is only removed with its last reference
+        if self.file and not (SourceFile.objects.filter(file=self.file.name).exclude(id=self.id).exists() or
+                              ProjectFile.objects.filter(file=self.file.name).exists()):
             self.file.delete()
         super().delete(using, keep_parents)
 
@@ -1439,8 +1912,28 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
 
-@receiver(post_save, sender=ProjectFileContent)
-def update_search_vector(sender, instance=None, created=False, **kwargs):
-    if created:
-        instance.search_vector = SearchVector("content")
-        instance.save()
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token_user(sender, instance=None, created=False, **kwargs):
+    # a new key cannot be cached yet
+    if not created:
+        cache.delete(token_user_cache_key(instance.key))
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_tokens(sender, instance=None, created=False, **kwargs):
+    if not created:
+        cache.delete_many([token_user_cache_key(k) for k in Token.objects.filter(user=instance).values_list("key", flat=True)])
+
+@receiver(user_logged_out)
+def invalidate_logged_out_user_tokens(sender, request=None, user=None, **kwargs):
+    if user is not None:
+        cache.delete_many([token_user_cache_key(k) for k in Token.objects.filter(user=user).values_list("key", flat=True)])
+
+@receiver(post_delete, sender=ProjectFile)
+def release_project_file_content(sender, instance=None, **kwargs):
+    # run for every deleted file, including the files deleted with their project or analysis group
+    if instance.file and (not instance.hash or instance.file.name != file_index.blob_name(instance.hash)):
+        # files that are not in the blob store yet are not shared with other records
+        instance.file.delete(save=False)
+    instance.release_content(instance.hash)
+
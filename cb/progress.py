@@ -0,0 +1,101 @@
+import time
+from typing import Optional
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+
+def progress_snapshot_cache_key(group: str, job: str = None) -> str:
+    """
+    Cache key of the latest message of a job, or of the list of jobs with a kept message when job is None
+    """
+    if job is None:
+        return f"progress_snapshot_{group}"
+    return f"progress_snapshot_{group}_{job}"
+
+
+def get_progress_snapshots(group: str) -> list:
+    """
+    Return the latest message of every job of a websocket group that is still kept, oldest job first
+    """
+    jobs = cache.get(progress_snapshot_cache_key(group)) or []
+    snapshots = cache.get_many([progress_snapshot_cache_key(group, job) for job in jobs])
+    return [snapshots[key] for key in (progress_snapshot_cache_key(group, job) for job in jobs) if key in snapshots]
+
+
+class ProgressReporter:
+    """
+    Publish the status messages of a job to the websocket group of a session.
+
+    Messages go to the f"{prefix}_{session_id}" group through its f"{prefix}_message" handler and every message holds the
+    fields given to the reporter. Status changes sent with send are always published. Progress updates sent with
+    progress are coalesced: one is only published when 1 / PROGRESS_MAX_RATE seconds passed since the last published
+    message or the percentage moved by PROGRESS_STEP since the last published update, otherwise it is kept and replaced
+    by the next one. flush publishes the update that is kept, send drops it as the new status supersedes it. Nothing is
+    published when there is no session.
+
+    The last published message is also kept in the cache as the snapshot of the job, identified by the fields of the
+    reporter, so that a client connecting to the group later gets the current state of the job without polling.
+    """
+
+    def __init__(self, prefix: str, session_id: Optional[str], max_rate: float = None, step: float = None, **fields):
+        self.group = f"{prefix}_{session_id}" if session_id else None
+        self.handler = f"{prefix}_message"
+        self.fields = fields
+        self.min_interval = 1 / (max_rate or settings.PROGRESS_MAX_RATE)
+        self.step = step if step is not None else settings.PROGRESS_STEP
+        self.channel_layer = get_channel_layer() if self.group else None
+        self.last_sent = None
+        self.last_percent = None
+        self.pending = None
+        self.job = ",".join(f"{k}={v}" for k, v in sorted(fields.items()))
+        self.registered = False
+
+    def publish(self, message: dict):
+        message = {**self.fields, **message}
+        async_to_sync(self.channel_layer.group_send)(self.group, {"type": self.handler, "message": message})
+        self.last_sent = time.monotonic()
+        self.save_snapshot(message)
+
+    def save_snapshot(self, message: dict):
+        cache.set(progress_snapshot_cache_key(self.group, self.job), message, settings.PROGRESS_SNAPSHOT_TIMEOUT)
+        if not self.registered:
+            jobs = [job for job in cache.get(progress_snapshot_cache_key(self.group)) or [] if job != self.job]
+            jobs.append(self.job)
+            cache.set(progress_snapshot_cache_key(self.group), jobs[-settings.PROGRESS_SNAPSHOT_LIMIT:], settings.PROGRESS_SNAPSHOT_TIMEOUT)
+            self.registered = True
+
+    def send(self, status: str, **message):
+        """
+        Publish a status message right away
+        """
+        if not self.group:
+            return
+        self.pending = None
+        self.publish({"status": status, **message})
+
+    def progress(self, percent: Optional[float] = None, status: str = "in_progress", **message):
+        """
+        Publish a progress update if one is due, percent is only used to decide if the update is due
+        """
+        if not self.group:
+            return
+        self.pending = {"status": status, **message}
+        due = self.last_sent is None or time.monotonic() - self.last_sent >= self.min_interval
+        if not due and percent is not None and self.step:
+            due = self.last_percent is None or abs(percent - self.last_percent) >= self.step
+        if due:
+            self.flush()
+            if percent is not None:
+                self.last_percent = percent
+
+    def flush(self):
+        """
+        Publish the progress update kept back by the rate limit if there is one
+        """
+        if self.pending is not None:
+            message = self.pending
+            self.pending = None
+            self.publish(message)
@@ -6,8 +6,7 @@ import shutil
 import uuid
 
 import pandas as pd
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer, channel_layers
+from channels.layers import channel_layers
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.signing import TimestampSigner
@@ -19,54 +18,61 @@ import re
 
 from sdrf_pipelines.sdrf.sdrf import SdrfDataFrame
 
+from cb.progress import ProgressReporter
 from cb.models import SearchSession, AnalysisGroup, CurtainData, Abs, SearchResult, SourceFile, MetadataColumn, Species, \
-    MSUniqueVocabularies, Unimod
+    MSUniqueVocabularies, Unimod, ProjectFile
 
 
-@job('default', timeout='3h')
+@job('search', timeout=settings.SEARCH_JOB_TIMEOUT)
 def start_search_session(search_session_id: int):
-    channel_layer = get_channel_layer()
-
     session = SearchSession.objects.get(id=search_session_id)
-    async_to_sync(channel_layer.group_send)(
-        f"search_{session.session_id}", {
-            "type": "search_message", "message": {
-                "type": "search_status",
-                "status": "started",
-                "id": session.id
-            }})
+    reporter = ProgressReporter("search", session.session_id, type="search_status", id=session.id)
+    reporter.send("started")
     try:
-        session.search_data()
+        session.search_data(reporter)
     except Exception as e:
         print(e)
         session.failed = True
         session.save()
-        async_to_sync(channel_layer.group_send)(
-            f"search_{session.session_id}", {
-                "type": "search_message", "message": {
-                    "type": "search_status",
-                    "status": "error",
-                    "id": session.id,
-                    "error": str(e)
-                }})
-
+        reporter.send("error", error=str(e))
         return
-    if session.session_id:
+    reporter.send("cancelled" if session.cancelled else "complete", partial=session.partial)
+    return session.id
 
-        async_to_sync(channel_layer.group_send)(
-            f"search_{session.session_id}", {
-                "type": "search_message", "message": {
-                    "type": "search_status",
-                    "status": "complete",
-                    "id": session.id
-                }}
+@job('ingest', timeout='3h')
+def process_project_file(project_file_id: int, session_id: str = None, file_hash: str = None):
+    """
+    Hash and index a bound file, progress is sent to the curtain_ group of the session. file_hash is the sha256 of the
+    file when it is already known from the upload.
+    """
+    project_file = ProjectFile.objects.get(id=project_file_id)
+    # only the fields the job owns are written so that edits made while it runs, such as a new extra_data, are kept
+    ProjectFile.objects.filter(id=project_file_id).update(index_status="processing")
+    project_file.index_status = "processing"
+    reporter = ProgressReporter(
+        "curtain", session_id, type="project_file_processing", project_file_id=project_file_id,
+        analysis_group_id=project_file.analysis_group_id
+    )
+
+    try:
+        project_file.save_altered(
+            on_step=lambda step: reporter.progress(step=step), file_hash=file_hash, update_fields=["file", "hash", "updated_at"]
         )
-    return session.id
+    except Exception as e:
+        print(e)
+        ProjectFile.objects.filter(id=project_file_id).update(index_status="failed")
+        reporter.send("error", error=str(e))
+        return
+    ProjectFile.objects.filter(id=project_file_id).update(index_status="ready")
+    project_file.index_status = "ready"
+    reporter.send("complete")
+    return project_file_id
+
 
-@job('default', timeout='3h')
+@job('ingest', timeout='3h')
 def load_curtain_data(analysis_group_id: int, curtain_link: str, session_id: str):
-    channel_layer = get_channel_layer()
     analysis_group = AnalysisGroup.objects.get(id=analysis_group_id)
+    reporter = ProgressReporter("curtain", session_id, type="curtain_status", analysis_group_id=analysis_group.id)
     pattern = r'[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}'
     match = re.search(pattern, curtain_link, re.I)
     if match:
@@ -74,34 +80,23 @@ def load_curtain_data(analysis_group_id: int, curtain_link: str, session_id: str
         analysis_group.curtain_data.all().delete()
         data = CurtainData.objects.create(analysis_group=analysis_group, host=settings.CURTAIN_HOST,
                                           link_id=match.group(0))
-        async_to_sync(channel_layer.group_send)(
-            f"curtain_{session_id}", {
-                "type": "curtain_message", "message": {
-                    "type": "curtain_status",
-                    "status": "started",
-                    "analysis_group_id": analysis_group.id
-                }})
+        reporter.send("started")
         data.get_curtain_data(session_id)
         analysis_group.save()
-    async_to_sync(channel_layer.group_send)(
-        f"curtain_{session_id}", {
-            "type": "curtain_message", "message": {
-                "type": "curtain_status",
-                "status": "complete",
-                "analysis_group_id": analysis_group.id
-            }})
+    reporter.send("complete")
 
-@job('default', timeout='3h')
+@job('ingest', timeout='3h')
 def compose_analysis_group_from_curtain_data(analysis_group_id: int, curtain_link: str, session_id: str):
-    channel_layer = get_channel_layer()
     analysis_group = AnalysisGroup.objects.get(id=analysis_group_id)
+    reporter = ProgressReporter("curtain", session_id, type="curtain_compose_status", analysis_group_id=analysis_group.id)
     pattern = r'[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}'
     match = re.search(pattern, curtain_link, re.I)
     if match:
         analysis_group.curtain_link = curtain_link
         analysis_group.curtain_data.all().delete()
-        project_files = analysis_group.project_files.filter(file_category__in=["searched", "df"])
-        project_files.delete()
+        # files are deleted one by one so that their blobs and derived artifacts are released
+        for project_file in analysis_group.project_files.filter(file_category__in=["searched", "df"]):
+            project_file.delete()
         curtain = analysis_group.curtain_data.all()
         if curtain:
             curtain.delete()
@@ -110,34 +105,15 @@ def compose_analysis_group_from_curtain_data(analysis_group_id: int, curtain_lin
             host=settings.CURTAIN_HOST,
             link_id=match.group(0)
         )
-        async_to_sync(channel_layer.group_send)(
-            f"curtain_{session_id}", {
-                "type": "curtain_message", "message": {
-                    "type": "curtain_compose_status",
-                    "status": "started",
-                    "analysis_group_id": analysis_group.id
-                }})
+        reporter.send("started")
         data.compose_analysis_group_from_curtain_data(analysis_group, session_id)
         analysis_group.save()
-    async_to_sync(channel_layer.group_send)(
-        f"curtain_{session_id}", {
-            "type": "curtain_message", "message": {
-                "type": "curtain_compose_status",
-                "status": "complete",
-                "analysis_group_id": analysis_group.id
-            }})
+    reporter.send("complete")
 
-@job('default', timeout='3h')
+@job('export', timeout='3h')
 def export_search_data(search_session_id: int, filter_term: str, filter_log2_fc: float = 0, filter_log10_p: float = 0, session_id: str = None, instance_id: str = None):
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"search_{session_id}", {
-            "type": "search_message", "message": {
-                "type": "export_status",
-                "status": "started",
-                "id": search_session_id,
-                "instance_id": instance_id
-            }})
+    reporter = ProgressReporter("search", session_id, type="export_status", id=search_session_id, instance_id=instance_id)
+    reporter.send("started")
 
     filter_term = filter_term.lower()
     search_session = SearchSession.objects.get(id=search_session_id)
@@ -155,14 +131,7 @@ def export_search_data(search_session_id: int, filter_term: str, filter_log2_fc:
 
     result = result.filter(query)
     if result.count() == 0:
-        async_to_sync(channel_layer.group_send)(
-            f"search_{session_id}", {
-                "type": "search_message", "message": {
-                    "type": "export_status",
-                    "status": "empty",
-                    "id": search_session_id,
-                    "instance_id": instance_id
-                }})
+        reporter.send("empty")
         return
     uuid_str = str(uuid.uuid4())
     tempt_path = os.path.join(settings.MEDIA_ROOT, "temp", uuid_str)
@@ -182,18 +151,10 @@ def export_search_data(search_session_id: int, filter_term: str, filter_log2_fc:
     shutil.rmtree(tempt_path)
     signer = TimestampSigner()
     value = signer.sign(f"{uuid_str}.zip")
-    async_to_sync(channel_layer.group_send)(
-        f"search_{session_id}", {
-            "type": "search_message", "message": {
-                "type": "export_status",
-                "status": "complete",
-                "id": search_session_id,
-                "file": value,
-                "instance_id": instance_id
-            }})
+    reporter.send("complete", file=value)
     return tempt_path + ".zip"
 
-@job('default', timeout='3h')
+@job('export', timeout='3h')
 def export_sdrf_task(analysis_group_id: int, uuid_str: str, session_id: str):
     tempt_path = os.path.join(settings.MEDIA_ROOT, "temp", uuid_str+".sdrf.tsv")
     sdrf = create_sdrf_array_from_metadata(analysis_group_id)
@@ -204,16 +165,8 @@ def export_sdrf_task(analysis_group_id: int, uuid_str: str, session_id: str):
 
     signer = TimestampSigner()
     value = signer.sign(f"{uuid_str}.sdrf.tsv")
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"curtain_{session_id}", {
-            "type": "curtain_message", "message": {
-                "type": "export_sdrf_status",
-                "status": "complete",
-                "file": value,
-                "analysis_group_id": analysis_group_id,
-                "job_id": uuid_str
-            }})
+    reporter = ProgressReporter("curtain", session_id, type="export_sdrf_status", analysis_group_id=analysis_group_id)
+    reporter.send("complete", file=value, job_id=uuid_str)
     return tempt_path
 
 
@@ -307,35 +260,22 @@ def create_sdrf_array_from_metadata(analysis_group_id):
     return sdrf
 
 
-@job('default', timeout='3h')
+@job('validation', timeout='3h')
 def validate_sdrf_file(analysis_group_id: int, session_id: str):
     sdrf = create_sdrf_array_from_metadata(analysis_group_id)
     df = SdrfDataFrame.parse(io.StringIO("\n".join(["\t".join(i) for i in sdrf])))
     errors = df.validate("default", True)
     errors = errors + df.validate("mass_spectrometry", True)
     errors = errors + df.validate_experimental_design()
-    channel_layer = get_channel_layer()
+    reporter = ProgressReporter("curtain", session_id, type="sdrf_validation", analysis_group_id=analysis_group_id)
     if errors:
-        async_to_sync(channel_layer.group_send)(
-            f"curtain_{session_id}", {
-                "type": "curtain_message", "message": {
-                    "type": "sdrf_validation",
-                    "status": "error",
-                    "analysis_group_id": analysis_group_id,
-                    "errors": [str(e) for e in errors]
-                }})
+        reporter.send("error", errors=[str(e) for e in errors])
     else:
-        async_to_sync(channel_layer.group_send)(
-            f"curtain_{session_id}", {
-                "type": "curtain_message", "message": {
-                    "type": "sdrf_validation",
-                    "status": "complete",
-                    "analysis_group_id": analysis_group_id
-                }})
+        reporter.send("complete")
 
-@job('default', timeout='3h')
+@job('ingest', timeout='3h')
 def process_imported_metadata_file(analysis_group_id, file_id, file_type, user_id, session_id):
-    channel_layer = get_channel_layer()
+    reporter = ProgressReporter("curtain", session_id, type="sdrf_import", analysis_group_id=analysis_group_id)
     user = User.objects.get(id=user_id)
     analysis_group = AnalysisGroup.objects.get(id=analysis_group_id)
     file = ChunkedUpload.objects.get(id=file_id)
@@ -426,14 +366,8 @@ def process_imported_metadata_file(analysis_group_id, file_id, file_type, user_i
                     metadata_column.analysis_group = analysis_group
 
 
-            async_to_sync(channel_layer.group_send)(
-                f"curtain_{session_id}", {
-                    "type": "curtain_message", "message": {
-                        "type": "sdrf_import",
-                        "status": "in_progress",
-                        "progress": 100 / (len(df.index)) * progress_count,
-                        "analysis_group_id": analysis_group_id
-                    }})
+            progress = 100 / (len(df.index)) * progress_count
+            reporter.progress(progress, progress=progress)
     elif file_type == "Spectronaut Condition Setup File":
         df = pd.read_csv(file.file.path, sep="\t")
 
@@ -484,19 +418,6 @@ def process_imported_metadata_file(analysis_group_id, file_id, file_type, user_i
                 column_position=hightest_position + 1
             )
             condition_metadata_column.save()
-            async_to_sync(channel_layer.group_send)(
-                f"curtain_{session_id}", {
-                    "type": "curtain_message", "message": {
-                        "type": "sdrf_import",
-                        "status": "in_progress",
-                        "progress": 100/(len(df.index))*progress_count,
-                        "analysis_group_id": analysis_group_id
-                    }})
-    async_to_sync(channel_layer.group_send)(
-        f"curtain_{session_id}", {
-            "type": "curtain_message", "message": {
-                "type": "sdrf_import",
-                "status": "complete",
-                "progress": 100,
-                "analysis_group_id": analysis_group_id
-            }})
+            progress = 100 / (len(df.index)) * progress_count
+            reporter.progress(progress, progress=progress)
+    reporter.send("complete", progress=100)
@@ -18,7 +18,7 @@ class ProjectSerializer(serializers.ModelSerializer):
 class ProjectFileSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProjectFile
-        fields = ['id', 'name', 'description', 'hash', 'file_type', 'file', 'file_category', 'project', 'load_file_content', 'created_at', 'updated_at', 'extra_data']
+        fields = ['id', 'name', 'description', 'hash', 'file_type', 'file', 'file_category', 'project', 'load_file_content', 'created_at', 'updated_at', 'extra_data', 'index_status']
 
 
 class AnalysisGroupSerializer(serializers.ModelSerializer):
@@ -100,7 +100,7 @@ class SearchSessionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = SearchSession
-        fields = ['id', 'search_term', 'created_at', 'updated_at', 'analysis_groups', 'user', 'session_id']
+        fields = ['id', 'search_term', 'created_at', 'updated_at', 'analysis_groups', 'user', 'session_id', 'partial', 'cancelled']
 
 class SpeciesSerializer(serializers.ModelSerializer):
     class Meta:
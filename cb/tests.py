@@ -1,8 +1,24 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+from asgiref.sync import async_to_sync
+
 from django.contrib.auth.models import User
-from django.contrib.postgres.search import SearchHeadline
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, SimpleTestCase, override_settings
 
-from cb.models import ProjectFile, ProjectFileContent, Project, SearchSession
+from cb.models import ProjectFile, Project, AnalysisGroup, SearchSession, SearchResult, ComparisonMatrix, \
+    SampleAnnotation, ProjectFileIdentifier, split_terms, search_cancel_cache_key
+from cb.bloom import BloomFilter
+from cb.executor import run_tasks
+from cb.progress import ProgressReporter, get_progress_snapshots
+from cb.file_index import compute_row_offsets, compute_columns, blob_name, artifact_dir, \
+    load_vocabulary, prefix_matches, fuzzy_matches, trigram_index, trigrams
 
 
 # Create your tests here.
@@ -15,67 +31,6 @@ def create_temporary_file():
     return file
 
 
-class TestProjectFileContent(TestCase):
-    def test_project_file_content(self):
-        project_file_content = ProjectFileContent.objects.create(
-            content='This is a test content',
-        )
-        results = ProjectFileContent.objects.filter(search_vector="test").annotate(
-            headline=SearchHeadline('content', "test", start_sel="<b>", stop_sel="</b>",
-                                    highlight_all=True)).distinct()
-        assert results.exists()
-        for i in results:
-            assert '<b>test</b> content' in i.headline
-
-    def test_project_file(self):
-        file = ProjectFile.objects.create(
-            name='Test File',
-            description='Test Description',
-            file_type='txt',
-            file_category='df',
-            load_file_content=True,
-        )
-        project_file_content = ProjectFileContent.objects.create(
-            content='This is a test content',
-            file=file
-        )
-
-        results = ProjectFile.objects.filter(file_contents__search_vector="test").annotate(
-            headline=SearchHeadline('file_contents__content', "test", start_sel="<b>", stop_sel="</b>",
-                                    highlight_all=True)).distinct()
-        assert results.exists()
-        for i in results:
-            assert '<b>test</b> content' in i.headline
-            result = i.get_search_items_from_headline()
-            assert 'test' in result
-            assert '<b>test</b> content' in result['test'][0]
-            print(result)
-
-    def test_project_file_multiple_content(self):
-        file = ProjectFile.objects.create(
-            name='Test File',
-            description='Test Description',
-            file_type='txt',
-            file_category='df',
-            load_file_content=True,
-        )
-        project_file_content = ProjectFileContent.objects.create(
-            content='This is a test content.This is a test2 content',
-            file=file
-        )
-        project_file_content = ProjectFileContent.objects.create(
-            content='This is a test2 content',
-            file=file
-        )
-
-        results = ProjectFile.objects.filter(file_contents__search_vector="test").annotate(
-            headline=SearchHeadline('file_contents__content', "test", start_sel="<b>", stop_sel="</b>",
-                                    highlight_all=True)).distinct()
-        assert results.exists()
-        for i in results:
-            print(i.headline)
-
-
 class TestProject(TestCase):
     def setUp(self):
         user = User.objects.create_user(
@@ -112,7 +67,7 @@ class TestProject(TestCase):
         file.analysis_group = analysis_group
         file.file = create_temporary_file()
         file.save()
-        file.load_file()
+        file.build_identifier_index()
 
         search_session = SearchSession.objects.create(
             search_term='test',
@@ -126,5 +81,1001 @@ class TestProject(TestCase):
         file.delete()
 
 
+def create_identifier_file(index=True):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+
+    content = "Protein.Group\tGenes\tLog2FC\tLog10P\n" \
+              "P12345\tMAPK3\t1.5\t3\n" \
+              "Q99999;P67890\tAKT1;AKT2\t-2\t4\n" \
+              "O11111\tTP53\t0.1\t0.2\n"
+    file = ProjectFile(
+        name='Test Identifier File',
+        description='Test Description',
+        file_type='txt',
+        file_category='df',
+        extra_data=json.dumps({"primary_id_col": "Protein.Group", "gene_name_col": "Genes", "uniprot_id_col": None}),
+    )
+    file.file.save("identifiers.txt", SimpleUploadedFile("identifiers.txt", content.encode()))
+    if index:
+        # searches leave files without an identifier index to the ingest worker, which is not run by these tests
+        file.build_identifier_index()
+    return file
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestProjectFileIdentifier(TestCase):
+    def test_build_identifier_index(self):
+        file = create_identifier_file()
+        file.build_identifier_index()
+        assert file.identifier_indexed
+        assert sorted(file.get_identifiers().filter(column_type="pi").values_list("value", "row")) == [
+            ("o11111", 4), ("p12345", 2), ("p67890", 3), ("q99999", 3)]
+        assert file.get_identifiers().filter(column_type="gene", value="akt2").get().row == 3
+        assert not file.get_identifiers().filter(column_type="uniprot").exists()
+
+    def test_read_rows_from_index(self):
+        file = create_identifier_file()
+        rows = file.get_row_numbers_for_primary_ids(["P67890", "O11111"])
+        assert rows == [3, 4]
+        assert file.read_columns(["Protein.Group"], rows)["Protein.Group"] == ["Q99999;P67890", "O11111"]
+
+    def test_read_rows_unindexed(self):
+        from unittest import mock
+
+        file = create_identifier_file()
+        ProjectFile.objects.filter(id=file.id).update(identifier_indexed=False)
+        file.refresh_from_db()
+        # a related file without an identifier index is queued for the ingest worker and read no rows until then
+        with mock.patch("cb.rq_tasks.process_project_file.delay") as delay, \
+                mock.patch.object(ProjectFile, "build_identifier_index", side_effect=AssertionError("indexed by the search")):
+            assert file.get_row_numbers_for_primary_ids(["P67890"]) == []
+        delay.assert_called_once_with(file.id, None, file.hash)
+        assert ProjectFile.objects.get(id=file.id).index_status == "pending"
+
+    def test_search_identifier_index(self):
+        file = create_identifier_file()
+        session = SearchSession.objects.create(search_term="akt2 or tp53", search_mode="gene")
+        hits = session.search_identifier_index(ProjectFile.objects.filter(id=file.id), split_terms(session.search_term))
+        assert hits[file.id]['file'] == file
+        assert hits[file.id]['index_hits'] == [(3, "akt2"), (4, "tp53")]
+        contexts = list(session.get_contexts(file, hits[file.id]['term_contexts'], hits[file.id]['index_hits']))
+        assert [(c["row"], c["term"]) for c in contexts] == [(3, "akt2"), (4, "tp53")]
+
+    def test_search_identifier_index_unindexed(self):
+        from unittest import mock
+
+        file = create_identifier_file()
+        ProjectFile.objects.filter(id=file.id).update(identifier_indexed=False)
+        session = SearchSession(search_term="akt2", search_mode="gene")
+        with mock.patch("cb.rq_tasks.process_project_file.delay") as delay, \
+                mock.patch.object(ProjectFile, "build_identifier_index", side_effect=AssertionError("indexed by the search")):
+            assert session.search_identifier_index(ProjectFile.objects.filter(id=file.id), split_terms("akt2")) == {}
+        delay.assert_called_once_with(file.id, None, file.hash or None)
+        assert ProjectFile.objects.get(id=file.id).index_status == "pending"
+
+    def test_build_identifier_index_only_missing(self):
+        file = create_identifier_file()
+        ProjectFile.objects.filter(id=file.id).update(identifier_indexed=False)
+        stale = ProjectFile.objects.get(id=file.id)
+        # a build that waited for another one to finish does not delete and insert the index again
+        ProjectFile.objects.filter(id=file.id).update(identifier_indexed=True)
+        count = file.get_identifiers().count()
+        ids = set(file.get_identifiers().values_list("id", flat=True))
+        stale.build_identifier_index(only_missing=True)
+        assert stale.identifier_indexed and bytes(stale.identifier_bloom) == bytes(file.identifier_bloom)
+        assert set(file.get_identifiers().values_list("id", flat=True)) == ids
+        stale.build_identifier_index()
+        assert file.get_identifiers().count() == count
+        assert not set(file.get_identifiers().values_list("id", flat=True)) & ids
+
+    def test_update_extra_data_queues_index(self):
+        from unittest import mock
+        from rest_framework.test import APIClient
+
+        file = create_identifier_file()
+        file.load_file_content = True
+        file.save()
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="editor", password="editor"))
+        with mock.patch("cb.rq_tasks.process_project_file.delay") as delay, \
+                mock.patch.object(ProjectFile, "build_identifier_index", side_effect=AssertionError("indexed in the request")):
+            response = client.patch(f"/api/project_files/{file.id}/", {
+                "extra_data": {"gene_name_col": "Genes"}, "session_id": "edit"
+            }, format="json", secure=True)
+        assert response.status_code == 200, response.data
+        delay.assert_called_once_with(file.id, "edit", file.hash or None)
+        file.refresh_from_db()
+        assert file.index_status == "pending" and not file.identifier_indexed
+
+    def test_identifier_match_types(self):
+        file = create_identifier_file()
+        files = ProjectFile.objects.filter(id=file.id)
+
+        def matched_rows(search_term, search_mode, match_type):
+            session = SearchSession(search_term=search_term, search_mode=search_mode, match_type=match_type)
+            hits = session.search_identifier_index(files, split_terms(search_term))
+            return hits[file.id]['index_hits'] if file.id in hits else []
+
+        assert matched_rows("p12345-2", "pi", "exact") == []
+        assert matched_rows("p12345-2", "pi", "isoform") == [(2, "p12345-2")]
+        assert matched_rows("akt", "gene", "prefix") == [(3, "akt"), (3, "akt")]
+        assert matched_rows("mapk", "gene", "fuzzy") == [(2, "mapk")]
+        # the sorted identifiers are saved next to a hashed file and reused
+        file.save_altered()
+        assert list(load_vocabulary(file.hash, "Genes")) == ["akt1", "akt2", "mapk3", "tp53"]
+        assert matched_rows("tp5", "gene", "prefix") == [(4, "tp5")]
+
+    def test_prune_files(self):
+        file = create_identifier_file()
+        file.save()
+        file.build_identifier_index()
+        other = create_identifier_file()
+        other.extra_data = json.dumps({"primary_id_col": "Protein.Group"})
+        other.save()
+        other.build_identifier_index()
+        legacy = create_identifier_file()
+        legacy.save()
+        files = ProjectFile.objects.filter(id__in=[file.id, other.id, legacy.id])
+        session = SearchSession(search_term="akt1", search_mode="gene")
+        # other has no gene column and legacy has no bloom filter yet
+        assert sorted(session.prune_files(files, split_terms("akt1")).values_list("id", flat=True)) == [file.id, legacy.id]
+        session.match_type = "isoform"
+        assert file.id in session.prune_files(files, split_terms("akt1-2")).values_list("id", flat=True)
+        session.search_mode = "pi"
+        assert sorted(session.prune_files(files, split_terms("p12345")).values_list("id", flat=True)) == [file.id, other.id, legacy.id]
+        session.match_type = "prefix"
+        assert session.prune_files(files, split_terms("zzz")) is files
+
+    def test_extract_result(self):
+        file = create_identifier_file()
+        ComparisonMatrix.objects.create(name="matrix", file=file, matrix=json.dumps([{
+            "fold_change_col": "Log2FC", "p_value_col": "Log10P", "condition_A": "A", "condition_B": "B",
+            "comparison_label": "A vs B"
+        }]))
+        session = SearchSession.objects.create(search_term="mapk3 or akt2 or tp53", search_mode="gene")
+        hits = session.search_identifier_index(ProjectFile.objects.filter(id=file.id), split_terms(session.search_term))
+        results = list(session.extract_result(file.id, hits[file.id]['term_contexts'], hits))
+        assert [(r.search_term, r.primary_id, r.gene_name, r.log2_fc, r.log10_p) for r in results] == [
+            ("mapk3", "P12345", "MAPK3", 1.5, 3), ("akt2", "Q99999;P67890", "AKT1;AKT2", -2, 4)]
+
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_enrich_related_results(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        analysis_group = AnalysisGroup.objects.create(name="group", description="group")
+        file = create_identifier_file()
+        file.analysis_group = analysis_group
+        file.save()
+        ComparisonMatrix.objects.create(name="matrix", file=file, matrix=json.dumps([{
+            "fold_change_col": "Log2FC", "p_value_col": "Log10P", "condition_A": "A", "condition_B": "B",
+            "comparison_label": "A vs B"
+        }]))
+        searched = ProjectFile(name="searched", description="searched", file_type="txt", file_category="searched",
+                               analysis_group=analysis_group, extra_data=json.dumps({"primary_id_col": "Protein.Group"}))
+        searched.file.save("searched.txt", SimpleUploadedFile(
+            "searched.txt", b"Protein.Group\tS1\tS2\nP12345\t10\t\nO11111\t5\t6\n"))
+        searched.build_identifier_index()
+        SampleAnnotation.objects.create(name="annotation", file=searched, annotations=json.dumps([
+            {"Sample": "S1", "Condition": "A"}, {"Sample": "S2", "Condition": "B"}]))
+        session = SearchSession.objects.create(search_term="mapk3", search_mode="gene")
+        hits = session.search_identifier_index(ProjectFile.objects.filter(id=file.id), split_terms(session.search_term))
+        result_map = {}
+        for result in session.extract_result(file.id, hits[file.id]['term_contexts'], hits):
+            result_map.setdefault(result.primary_id, {}).setdefault(analysis_group.id, {})[result.comparison_label] = result
+        session.enrich_related_results({analysis_group.id: {file.id: {"P12345"}}}, result_map)
+        assert json.loads(result_map["P12345"][analysis_group.id]["A vs B"].searched_data) == [
+            {"Sample": "S1", "Condition": "A", "Value": 10.0}, {"Sample": "S2", "Condition": "B", "Value": None}]
+
+
+    @override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}, SEARCH_WORKERS=1,
+                       CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_search_data(self):
+        analysis_group = AnalysisGroup.objects.create(name="group", description="group")
+        file = create_identifier_file()
+        file.analysis_group = analysis_group
+        file.save()
+        ComparisonMatrix.objects.create(name="matrix", file=file, matrix=json.dumps([{
+            "fold_change_col": "Log2FC", "p_value_col": "Log10P", "condition_A": "A", "condition_B": "B",
+            "comparison_label": "A vs B"
+        }]))
+        session = SearchSession.objects.create(search_term="akt1 or tp53", search_mode="gene", session_id="test")
+        session.analysis_groups.add(analysis_group)
+        session.search_data()
+        assert session.completed
+        assert list(session.search_results.values_list("primary_id", "comparison_label", "log2_fc")) == [
+            ("Q99999;P67890", "A vs B", -2)]
+
+        # the same search over the same files is answered from the result cache
+        repeat = SearchSession.objects.create(search_term="TP53 or AKT1", search_mode="gene", session_id="test")
+        repeat.analysis_groups.add(analysis_group)
+        cache_key = session.get_cache_key(ProjectFile.objects.filter(id=file.id))
+        assert repeat.get_cache_key(ProjectFile.objects.filter(id=file.id)) == cache_key
+        # without the cache the repeat would find nothing once the index is emptied
+        file.get_identifiers().all().delete()
+        repeat.search_data()
+        assert list(repeat.search_results.values_list("primary_id", "log2_fc")) == [("Q99999;P67890", -2)]
+
+        # a changed file hash gives a new key
+        ProjectFile.objects.filter(id=file.id).update(hash="changed")
+        assert repeat.get_cache_key(ProjectFile.objects.filter(id=file.id)) != cache_key
+
+    @override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}, SEARCH_WORKERS=1,
+                       CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_cache_key_settings(self):
+        analysis_group = AnalysisGroup.objects.create(name="group", description="group")
+        file = create_identifier_file()
+        file.analysis_group = analysis_group
+        file.save()
+        matrix = ComparisonMatrix.objects.create(name="matrix", file=file, matrix=json.dumps([{
+            "fold_change_col": "Log2FC", "p_value_col": "Log10P", "condition_A": "A", "condition_B": "B",
+            "comparison_label": "A vs B"
+        }]))
+        session = SearchSession.objects.create(search_term="akt1", search_mode="gene", session_id="settings")
+        session.analysis_groups.add(analysis_group)
+        files = ProjectFile.objects.filter(id=file.id)
+        keys = [session.get_cache_key(files)]
+        # the comparison matrix, sample annotation and column mapping change the results without changing the hash
+        matrix.matrix = json.dumps([{
+            "fold_change_col": "Log2FC", "p_value_col": "Log10P", "condition_A": "A", "condition_B": "C",
+            "comparison_label": "A vs C"
+        }])
+        matrix.save()
+        keys.append(session.get_cache_key(files))
+        SampleAnnotation.objects.create(name="annotation", file=file, annotations=json.dumps([{"Sample": "Log2FC", "Condition": "A"}]))
+        keys.append(session.get_cache_key(files))
+        ProjectFile.objects.filter(id=file.id).update(extra_data=json.dumps({"primary_id_col": "Protein.Group"}))
+        keys.append(session.get_cache_key(files))
+        assert len(set(keys)) == 4
+
+        # a search that left out a file of the group that was not indexed yet is not cached
+        ProjectFile.objects.filter(id=file.id).update(extra_data=file.extra_data)
+        pending = create_identifier_file()
+        pending.analysis_group = analysis_group
+        pending.index_status = "pending"
+        pending.save()
+        assert not session.all_files_indexed(files)
+        session.search_data()
+        assert session.completed and not cache.get(session.get_cache_key(files))
+        ProjectFile.objects.filter(id=pending.id).update(index_status="ready", identifier_indexed=False)
+        assert not session.all_files_indexed(files)
+        ProjectFile.objects.filter(id=pending.id).update(identifier_indexed=True)
+        assert session.all_files_indexed(files)
+        complete = SearchSession.objects.create(search_term="akt1", search_mode="gene", session_id="settings")
+        complete.analysis_groups.add(analysis_group)
+        complete.search_data()
+        assert cache.get(complete.get_cache_key(files)) == complete.id
+
+
+    @override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}, SEARCH_WORKERS=1,
+                       CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_plan_search(self):
+        small_group = AnalysisGroup.objects.create(name="small", description="small")
+        large_group = AnalysisGroup.objects.create(name="large", description="large")
+        files = []
+        for analysis_group in [large_group, small_group, large_group]:
+            file = create_identifier_file()
+            file.analysis_group = analysis_group
+            file.save()
+            ComparisonMatrix.objects.create(name="matrix", file=file, matrix=json.dumps([{
+                "fold_change_col": "Log2FC", "p_value_col": "Log10P", "condition_A": "A", "condition_B": "B",
+                "comparison_label": "A vs B"
+            }]))
+            files.append(file)
+        session = SearchSession.objects.create(search_term="akt1 or tp53", search_mode="gene", session_id="plan")
+        session.analysis_groups.add(small_group, large_group)
+        hits = session.search_identifier_index(ProjectFile.objects.all(), split_terms(session.search_term))
+        # both files of the large group are read for the related results so it is planned last
+        assert session.plan_search(hits) == [
+            (small_group.id, [files[1].id], 2), (large_group.id, [files[0].id, files[2].id], 8)]
+
+        with override_settings(SEARCH_WORK_BUDGET=5):
+            session.search_data()
+        assert session.completed and session.partial
+        assert set(session.search_results.values_list("file_id", flat=True)) == {files[1].id}
+
+    @override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}, SEARCH_WORKERS=1,
+                       CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_cancel_search(self):
+        from cinderBackend.consumers import cancel_search_session
+
+        analysis_group = AnalysisGroup.objects.create(name="group", description="group")
+        file = create_identifier_file()
+        file.analysis_group = analysis_group
+        file.save()
+        session = SearchSession.objects.create(search_term="akt1", search_mode="gene", session_id="cancel")
+        session.analysis_groups.add(analysis_group)
+        # only searches started from the same websocket session can be cancelled from it
+        assert not cancel_search_session(session.id, "other")
+        assert cancel_search_session(session.id, "cancel")
+        # a search cancelled before it started does not run
+        session.search_data()
+        assert session.cancelled and not session.completed and not session.in_progress
+        # the flag in the cache lasts as long as a search job can run, not as long as cached results
+        with override_settings(SEARCH_JOB_TIMEOUT=-1, SEARCH_RESULT_CACHE_TIMEOUT=60):
+            cache.delete(search_cancel_cache_key(session.id))
+            session.cancel()
+            assert cache.get(search_cancel_cache_key(session.id)) is None
+
+        # a running search sees the flag in the cache, stops before the next file and keeps what it found
+        running = SearchSession.objects.create(search_term="akt1", search_mode="gene", session_id="cancel")
+        running.analysis_groups.add(analysis_group)
+        cache.set(search_cancel_cache_key(running.id), True)
+        running.search_data()
+        assert running.completed and running.cancelled and running.partial
+        assert not running.search_results.exists()
+
+    @override_settings(SEARCH_RESULT_BATCH_SIZE=2)
+    def test_save_results(self):
+        analysis_group = AnalysisGroup.objects.create(name="group", description="group")
+        session = SearchSession.objects.create(search_term="akt1", search_mode="gene")
+        result_map = {
+            primary_id: {analysis_group.id: {label: SearchResult(
+                search_term="akt1", session=session, analysis_group=analysis_group, primary_id=primary_id,
+                comparison_label=label) for label in ["A vs B", "A vs C"]}}
+            for primary_id in ["P12345", "P67890"]
+        }
+        # four results in batches of two are written with two inserts
+        with self.assertNumQueries(2):
+            assert session.save_results(result_map) == 4
+        assert sorted(session.search_results.values_list("primary_id", "comparison_label")) == [
+            ("P12345", "A vs B"), ("P12345", "A vs C"), ("P67890", "A vs B"), ("P67890", "A vs C")]
+        with self.assertNumQueries(0):
+            assert session.save_results({}) == 0
+
+    @override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}, SEARCH_WORKERS=1,
+                       CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_search_data_saves_each_group(self):
+        from unittest import mock
+
+        groups = [AnalysisGroup.objects.create(name=name, description=name) for name in ["first", "second"]]
+        for analysis_group in groups:
+            file = create_identifier_file()
+            file.analysis_group = analysis_group
+            file.save()
+            ComparisonMatrix.objects.create(name="matrix", file=file, matrix=json.dumps([{
+                "fold_change_col": "Log2FC", "p_value_col": "Log10P", "condition_A": "A", "condition_B": "B",
+                "comparison_label": "A vs B"
+            }]))
+        session = SearchSession.objects.create(search_term="akt1 or tp53", search_mode="gene", session_id="groups")
+        session.analysis_groups.add(*groups)
+        saved_groups = []
+        save_results = session.save_results
+
+        def record_save(result_map):
+            # the results of a group are written before the next group is searched
+            saved_groups.append({g for groups_of_id in result_map.values() for g in groups_of_id})
+            assert session.search_results.count() == len(saved_groups) - 1
+            return save_results(result_map)
+
+        reporter = mock.Mock()
+        with mock.patch.object(session, "save_results", side_effect=record_save):
+            session.search_data(reporter)
+        assert saved_groups == [{groups[0].id}, {groups[1].id}]
+        assert session.completed and session.search_results.count() == 2
+        # progress carries the number of results saved so far and the first saved results are announced
+        assert [c.kwargs["result_count"] for c in reporter.progress.call_args_list] == [0, 0, 1, 1, 2]
+        reporter.send.assert_called_once_with("first_results", result_count=1)
+
+    def test_search_full_text(self):
+        file = create_identifier_file()
+        file.load_file_content = True
+        file.save()
+        file.save_altered()
+        session = SearchSession(search_term="akt1 or tp53", search_mode="full")
+        hits = session.search_full_text(ProjectFile.objects.filter(id=file.id), split_terms(session.search_term))
+        assert hits[file.id]["term_contexts"] == {"akt1": [], "tp53": []}
+        contexts = list(session.get_contexts(file, hits[file.id]["term_contexts"], hits[file.id]["index_hits"]))
+        assert [(c["row"], c["term"]) for c in contexts] == [(3, "akt1"), (4, "tp53")]
+
+    def test_search_full_text_unindexed(self):
+        from unittest import mock
+        from cb.rq_tasks import process_project_file
+
+        file = create_identifier_file()
+        file.load_file_content = True
+        file.identifier_indexed = False
+        file.save()
+        session = SearchSession(search_term="akt1", search_mode="full")
+        # the search does not index the file, it is queued for the ingest worker once and left out until then
+        with mock.patch("cb.rq_tasks.process_project_file.delay") as delay, \
+                mock.patch.object(ProjectFile, "build_identifier_index", side_effect=AssertionError("indexed by the search")):
+            assert session.search_full_text(ProjectFile.objects.filter(id=file.id), split_terms("akt1")) == {}
+            assert session.search_full_text(ProjectFile.objects.filter(id=file.id), split_terms("akt1")) == {}
+        delay.assert_called_once_with(file.id, None, file.hash)
+        file.refresh_from_db()
+        assert file.index_status == "pending"
+        process_project_file(file.id)
+        hits = session.search_full_text(ProjectFile.objects.filter(id=file.id), split_terms("akt1"))
+        assert list(hits) == [file.id]
+
+    def test_shared_identifier_index(self):
+        file = create_identifier_file()
+        key = file.get_identifier_key()
+        assert file.hash and key.startswith(f"{file.hash}:")
+        # the index is shared with a file of the same content and columns
+        other = create_identifier_file()
+        assert other.identifier_indexed and other.get_identifier_key() == key
+        assert ProjectFileIdentifier.objects.filter(content_key=key, value="akt2").count() == 1
+        # a file of the same content with other columns gets its own index
+        genes_only = create_identifier_file()
+        genes_only.extra_data = json.dumps({"gene_name_col": "Genes"})
+        genes_only.save()
+        genes_only.build_identifier_index()
+        assert genes_only.get_identifier_key() != key
+        assert set(genes_only.get_identifiers().values_list("value", flat=True)) == {"mapk3", "akt1", "akt2", "tp53"}
+        genes_only.delete()
+        assert not ProjectFileIdentifier.objects.filter(content_key=genes_only.get_identifier_key()).exists()
+        other.delete()
+        assert ProjectFileIdentifier.objects.filter(content_key=key).exists()
+
+    def test_process_project_file(self):
+        from cb.rq_tasks import process_project_file
+
+        file = create_identifier_file(index=False)
+        file.index_status = "pending"
+        file.load_file_content = True
+        file.save()
+        process_project_file(file.id)
+        file.refresh_from_db()
+        assert file.index_status == "ready"
+        assert file.hash
+        assert file.identifier_indexed
+
+    def test_process_project_file_keeps_edits(self):
+        from unittest import mock
+        from cb.rq_tasks import process_project_file
+
+        file = create_identifier_file(index=False)
+        file.index_status = "pending"
+        file.load_file_content = True
+        file.save()
+        genes_only = json.dumps({"gene_name_col": "Genes"})
+
+        def edit(step=None):
+            # extra_data is changed the way the update view does while the job runs
+            if step == "columns":
+                ProjectFile.objects.filter(id=file.id).update(
+                    extra_data=genes_only, identifier_indexed=False
+                )
+
+        with mock.patch.object(ProgressReporter, "progress", side_effect=edit):
+            process_project_file(file.id)
+        file.refresh_from_db()
+        assert file.extra_data == genes_only and file.index_status == "ready"
+        # the identifier index is built from the new columns read when the index is locked
+        assert file.identifier_indexed
+        assert set(file.get_identifiers().values_list("column_type", flat=True)) == {"gene"}
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+                   CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TestCurtainCompose(TestCase):
+    def test_compose_queues_project_files(self):
+        from unittest import mock
+        from cb.models import CurtainData
+        from cb.rq_tasks import process_project_file
+
+        analysis_group = AnalysisGroup.objects.create(name="curtain", description="curtain")
+        curtain_data = CurtainData.objects.create(host="https://curtain", link_id="link", analysis_group=analysis_group)
+        data = {
+            "processed": "Index\tFC\tP\nP12345\t1.5\t3\n",
+            "raw": "Index\tS1.1\nP12345\t10\n",
+            "differentialForm": {
+                "_primaryIDs": "Index", "_foldChange": "FC", "_significant": "P", "_transformFC": False,
+                "_transformSignificant": False, "_reverseFoldChange": False, "_comparison": "CurtainSetComparison",
+                "_comparisonSelect": "",
+            },
+            "rawForm": {"_primaryIDs": "Index", "_samples": ["S1.1"]},
+            "settings": {},
+        }
+        with mock.patch("cb.models.CurtainClient.download_curtain_session", return_value=data), \
+                mock.patch.object(CurtainData, "parse_curtain_data"), \
+                mock.patch("cb.rq_tasks.process_project_file.delay") as delay, \
+                mock.patch.object(ProjectFile, "save_altered", side_effect=AssertionError("indexed by the compose job")):
+            curtain_data.compose_analysis_group_from_curtain_data(analysis_group, "compose")
+        files = list(analysis_group.project_files.order_by("id"))
+        # the files are left out of searches until the ingest worker has indexed them
+        assert [f.index_status for f in files] == ["pending", "pending"]
+        assert [c.args for c in delay.call_args_list] == [(f.id, "compose", None) for f in files]
+        for f in files:
+            process_project_file(f.id)
+        assert list(analysis_group.project_files.values_list("index_status", flat=True)) == ["ready", "ready"]
+
+
+class TestRowOffsets(SimpleTestCase):
+    def test_compute_row_offsets(self):
+        content = b"a\tb\n1\t2\n\n33\t44\n"
+        assert list(compute_row_offsets(io.BytesIO(content), block_size=3)) == [0, 4, 8, 9]
+        assert list(compute_row_offsets(io.BytesIO(b"a\nb"))) == [0, 2]
+        assert list(compute_row_offsets(io.BytesIO(b""))) == []
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestProjectFileRowIndex(TestCase):
+    def test_get_file_line(self):
+        file = create_identifier_file()
+        file.save_altered()
+        assert file.hash
+        rows = list(file.get_file_line([4, 2, 10]))
+        assert [(n, r["Genes"]) for n, r in rows] == [(4, "TP53"), (2, "MAPK3")]
+
+    def test_link_file(self):
+        import os
+        from django.conf import settings
+
+        source = os.path.join(settings.MEDIA_ROOT, "upload.part")
+        with open(source, "wb") as f:
+            f.write(b"Genes\nMAPK3\n")
+        file = ProjectFile(name="linked", description="linked", file_type="txt", file_category="df")
+        assert file.link_file(source, "linked.txt")
+        assert file.file.name.startswith("user_files/linked")
+        assert os.path.samefile(source, file.file.path)
+        file.save()
+        file.save_altered(file_hash="known")
+        assert file.hash == "known"
+        assert file.read_columns(["Genes"]) == {"Genes": ["MAPK3"]}
+
+    def test_link_file_taken_name(self):
+        import os
+        from unittest import mock
+        from django.conf import settings
+
+        source = os.path.join(settings.MEDIA_ROOT, "taken.part")
+        with open(source, "wb") as f:
+            f.write(b"Genes\nMAPK3\n")
+        taken = os.path.join(settings.MEDIA_ROOT, "user_files", "taken.txt")
+        os.makedirs(os.path.dirname(taken), exist_ok=True)
+        with open(taken, "wb") as f:
+            f.write(b"other upload")
+        file = ProjectFile(name="taken", description="taken", file_type="txt", file_category="df")
+        # a name taken by another upload after it was picked is not overwritten by the fallback move
+        with mock.patch.object(file.file.storage, "get_available_name", return_value="user_files/taken.txt"):
+            with self.assertRaises(FileExistsError):
+                file.link_file(source, "taken.txt")
+        with open(taken, "rb") as f:
+            assert f.read() == b"other upload"
+        assert os.path.exists(source)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_bind_uploaded_file_reuses_checksum(self):
+        import hashlib
+        from unittest import mock
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from rest_framework.test import APIClient
+        from cb.rq_tasks import process_project_file
+
+        content = b"Genes\tLog2FC\nMAPK3\t1\n"
+        checksum = hashlib.sha256(content).hexdigest()
+        user = User.objects.create_user(username="uploader", password="uploader")
+        analysis_group = AnalysisGroup.objects.create(name="group", description="group")
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post("/api/chunked_upload/", {
+            "file": SimpleUploadedFile("upload.txt", content), "filename": "upload.txt", "sha256": checksum
+        }, format="multipart", secure=True)
+        assert response.status_code == 200, response.data
+        with mock.patch("cb.viewsets.process_project_file.delay") as delay:
+            response = client.post("/api/project_files/bind_uploaded_file/", {
+                "analysis_group": analysis_group.id, "upload_id": response.data["id"], "file_name": "upload.txt",
+                "file_type": "txt", "file_category": "df"
+            }, format="json", secure=True)
+        assert response.status_code == 201, response.data
+        project_file_id, session_id, file_hash = delay.call_args.args
+        assert file_hash == checksum
+        # the verified checksum is used as the hash so the worker does not read the file to hash it
+        with mock.patch.object(ProjectFile, "compute_hash", side_effect=AssertionError("hashed again")):
+            process_project_file(project_file_id, session_id, file_hash)
+        project_file = ProjectFile.objects.get(id=project_file_id)
+        assert project_file.hash == checksum and project_file.index_status == "ready"
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestBlobStore(TestCase):
+    def create_indexed_file(self):
+        file = create_identifier_file(index=False)
+        file.load_file_content = True
+        file.save()
+        upload_path = file.file.path
+        file.save_altered()
+        return file, upload_path
+
+    def test_shared_blob(self):
+        import os
+
+        first, first_upload = self.create_indexed_file()
+        second, second_upload = self.create_indexed_file()
+        assert first.file.name == second.file.name == blob_name(first.hash)
+        assert os.path.exists(first.file.path)
+        assert not os.path.exists(first_upload) and not os.path.exists(second_upload)
+        # the identifiers are only indexed once for both files
+        assert ProjectFileIdentifier.objects.filter(content_key=first.get_identifier_key(), value="akt1").count() == 1
+        session = SearchSession(search_term="akt1", search_mode="full")
+        result = session.search_full_text(ProjectFile.objects.filter(id__in=[first.id, second.id]), split_terms("akt1"))
+        assert sorted(result) == [first.id, second.id]
+        assert result[second.id]["term_contexts"] == result[first.id]["term_contexts"]
+
+    def test_release_blob(self):
+        import os
+
+        first, _ = self.create_indexed_file()
+        second, _ = self.create_indexed_file()
+        first.delete()
+        # the identifiers, blob and artifacts are kept for the file that still references them
+        assert second.get_identifiers().exists()
+        assert os.path.exists(second.file.path)
+        assert os.path.isdir(artifact_dir(second.hash))
+        path = second.file.path
+        second.delete()
+        assert not second.get_identifiers().exists()
+        assert not os.path.exists(path)
+        assert not os.path.exists(artifact_dir(second.hash))
+
+    def test_release_blob_on_cascade(self):
+        import os
+
+        user = User.objects.create_user(username="owner", password="owner")
+        project = Project.objects.create(name="project", hash="project", global_id="project", user=user)
+        analysis_group = AnalysisGroup.objects.create(name="group", description="group", project=project)
+        file, _ = self.create_indexed_file()
+        file.analysis_group = analysis_group
+        file.save()
+        path = file.file.path
+        key = file.get_identifier_key()
+        # files deleted with their project release their content the same as a file deleted on its own
+        project.delete()
+        assert not ProjectFile.objects.filter(id=file.id).exists()
+        assert not ProjectFileIdentifier.objects.filter(content_key=key).exists()
+        assert not os.path.exists(path)
+        assert not os.path.exists(artifact_dir(file.hash))
+
+    def test_failed_build_keeps_blob(self):
+        import os
+        from unittest import mock
+
+        file = create_identifier_file(index=False)
+        file.save()
+        with mock.patch.object(ProjectFile, "build_identifier_index", side_effect=RuntimeError("failed")):
+            with self.assertRaises(RuntimeError):
+                file.save_altered()
+        # the row points at the blob the upload was moved to even though the build did not finish
+        saved = ProjectFile.objects.get(id=file.id)
+        assert saved.hash == file.hash and saved.file.name == blob_name(file.hash)
+        assert os.path.exists(saved.file.path)
+        # a file with the same content deleted meanwhile sees this one holding the blob
+        other, _ = self.create_indexed_file()
+        other.delete()
+        assert os.path.exists(saved.file.path)
+
+
+class TestComparisonMatrixMask(SimpleTestCase):
+    def test_comparison_matrix_mask(self):
+        session = SearchSession(log2_fc=0.6, log10_p_value=1.31)
+        values = {
+            "fc1": np.array([1.0, -2.0, 0.0, np.nan]),
+            "p1": np.array([2.0, 1.0, 3.0, 2.0]),
+            "fc2": np.array([-0.7, 0.5, 1.0, 1.0]),
+        }
+        matrix = [
+            {"fold_change_col": "fc1", "p_value_col": "p1"},
+            {"fold_change_col": "fc2", "p_value_col": "p1"},
+            {"fold_change_col": "fc2", "p_value_col": "missing"},
+        ]
+        log2_fc, log10_p, passed = session.comparison_matrix_mask(values, matrix, 4)
+        assert log2_fc.shape == (4, 3)
+        assert [tuple(p) for p in np.argwhere(passed)] == [(0, 0), (0, 1), (2, 1), (3, 1)]
+
+
+class TestVocabulary(SimpleTestCase):
+    def test_prefix_and_fuzzy_matches(self):
+        vocabulary = np.array(["akt1", "akt2", "akt3-2", "mapk1", "mapk3", "p12345", "p12345-2"], dtype=str)
+        assert prefix_matches(vocabulary, "akt") == ["akt1", "akt2", "akt3-2"]
+        assert prefix_matches(vocabulary, "p12345") == ["p12345", "p12345-2"]
+        assert prefix_matches(vocabulary, "tp53") == []
+        assert fuzzy_matches(vocabulary, "mapk", 0.3) == ["mapk1", "mapk3"]
+        assert fuzzy_matches(vocabulary, "mapk", 0.9) == []
+
+    def test_fuzzy_matches_index(self):
+        import random
+        from unittest import mock
+
+        rng = random.Random(0)
+        vocabulary = np.array(sorted({"".join(rng.choice("abkmpt123-") for _ in range(rng.randint(1, 8)))
+                                      for _ in range(2000)}), dtype=str)
+
+        def similar(term, value, threshold):
+            shared = len(trigrams(term) & trigrams(value))
+            return shared and shared / (len(trigrams(term)) + len(trigrams(value)) - shared) >= threshold
+
+        index = trigram_index(vocabulary)
+        # the trigrams of the vocabulary are only computed when the index is built
+        with mock.patch("cb.file_index.trigrams", side_effect=trigrams) as counted:
+            for term in ["akt1", "mapk", "p12", "t", "zzz"]:
+                for threshold in [0.1, 0.3, 0.6]:
+                    assert fuzzy_matches(vocabulary, term, threshold, index) == [
+                        str(v) for v in vocabulary if similar(term, str(v), threshold)]
+        assert counted.call_count == 15
+        assert fuzzy_matches(np.array([], dtype=str), "akt1", 0.3) == []
+
+
+class TestBloomFilter(SimpleTestCase):
+    def test_bloom_filter(self):
+        values = [f"p{i}" for i in range(5000)]
+        bloom = BloomFilter.from_bytes(BloomFilter.from_values(values, 0.01).to_bytes())
+        assert all(bloom.might_contain(v) for v in values)
+        false_positives = sum(bloom.might_contain(f"q{i}") for i in range(5000))
+        assert false_positives < 150
+        assert not BloomFilter.from_values([], 0.01).might_contain("p1")
+
+
+class TestRunTasks(SimpleTestCase):
+    def test_run_tasks_keeps_order(self):
+        import time
+
+        progress = []
+        results = run_tasks(lambda x: time.sleep(0.01 * (5 - x)) or x * 2, range(5), workers=4, on_done=progress.append)
+        assert results == [0, 2, 4, 6, 8]
+        assert progress == [1, 2, 3, 4, 5]
+        assert run_tasks(lambda x: x + 1, [1, 2], workers=1) == [2, 3]
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+                   CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TestProgressReporter(SimpleTestCase):
+    def receive_all(self, channel_layer, channel):
+        async def receive():
+            messages = []
+            while True:
+                try:
+                    messages.append(await asyncio.wait_for(channel_layer.receive(channel), 0.1))
+                except asyncio.TimeoutError:
+                    return [m["message"] for m in messages]
+        return async_to_sync(receive)()
+
+    def test_progress_coalesced(self):
+        reporter = ProgressReporter("search", "abc", max_rate=0.001, step=10, type="search_status", id=1)
+        channel_layer = reporter.channel_layer
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)("search_abc", channel)
+        for i in range(101):
+            reporter.progress(i, current_progress=i)
+        reporter.send("complete")
+        messages = self.receive_all(channel_layer, channel)
+        assert [m["current_progress"] for m in messages[:-1]] == list(range(0, 101, 10))
+        assert messages[-1] == {"type": "search_status", "id": 1, "status": "complete"}
+
+    def test_flush(self):
+        reporter = ProgressReporter("curtain", "abc", max_rate=0.001, step=0, type="sdrf_import")
+        channel_layer = reporter.channel_layer
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)("curtain_abc", channel)
+        reporter.progress(step="content")
+        reporter.progress(step="row_index")
+        reporter.progress(step="columns")
+        reporter.flush()
+        assert [m["step"] for m in self.receive_all(channel_layer, channel)] == ["content", "columns"]
+        assert ProgressReporter("curtain", None).channel_layer is None
+
+    def test_snapshots(self):
+        cache.clear()
+        search = ProgressReporter("search", "snap", type="search_status", id=1)
+        export = ProgressReporter("search", "snap", type="export_status", id=1, instance_id="a")
+        search.send("started")
+        export.send("started")
+        search.progress(10, current_progress=1)
+        search.send("complete", partial=False)
+        assert get_progress_snapshots("search_snap") == [
+            {"type": "search_status", "id": 1, "status": "complete", "partial": False},
+            {"type": "export_status", "id": 1, "instance_id": "a", "status": "started"}]
+        assert get_progress_snapshots("search_other") == []
+        with override_settings(PROGRESS_SNAPSHOT_LIMIT=1):
+            ProgressReporter("search", "snap", type="search_status", id=2).send("started")
+        assert get_progress_snapshots("search_snap") == [{"type": "search_status", "id": 2, "status": "started"}]
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+                   CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+                   WEBSOCKET_COMMAND_RATE=0.001, WEBSOCKET_COMMAND_BURST=3)
+class TestSessionConsumer(SimpleTestCase):
+    def test_receive_json(self):
+        from channels.layers import get_channel_layer
+        from cinderBackend.consumers import SearchConsumer
+
+        cache.clear()
+        ProgressReporter("search", "consumer", type="search_status", id=1).send("started")
+        channel_layer = get_channel_layer()
+        listener = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)("search_consumer", listener)
+        consumer = SearchConsumer()
+        consumer.scope = {"url_route": {"kwargs": {"session_id": "consumer"}}}
+        consumer.channel_layer = channel_layer
+        consumer.channel_name = async_to_sync(channel_layer.new_channel)()
+        sent = []
+
+        async def send_json(content, close=False):
+            sent.append(content)
+
+        async def accept(subprotocol=None, headers=None):
+            pass
+
+        consumer.send_json = send_json
+        consumer.accept = accept
+        async_to_sync(consumer.connect)()
+        assert sent[-1] == {"type": "search_status", "id": 1, "status": "started"}
+
+        sent.clear()
+        for content in [{"type": "search_message", "message": "spam"}, {"message": "spam"}, ["spam"],
+                        {"type": "request_snapshot"}, {"type": "unsubscribe"}, {"type": "subscribe"},
+                        {"type": "request_snapshot"}]:
+            async_to_sync(consumer.receive_json)(content)
+        # unknown messages are dropped, the burst allows three commands and the snapshot of the subscribe
+        assert sent == [{"type": "search_status", "id": 1, "status": "started"}] * 2
+        # nothing the client sent reached the group
+        async def receive():
+            return await asyncio.wait_for(channel_layer.receive(listener), 0.1)
+        with self.assertRaises(asyncio.TimeoutError):
+            async_to_sync(receive)()
+
+
+class TestSearchSessionActive(TestCase):
+    def test_count_active(self):
+        user = User.objects.create_user(username="searcher", password="searcher")
+        SearchSession.objects.create(search_term="a", user=user)
+        SearchSession.objects.create(search_term="b", user=user, pending=False, in_progress=True)
+        SearchSession.objects.create(search_term="c", user=user, pending=False, completed=True)
+        SearchSession.objects.create(search_term="d", user=user, failed=True)
+        SearchSession.objects.create(search_term="e", user=user, cancelled=True)
+        SearchSession.objects.create(search_term="f", session_id="anonymous")
+        assert SearchSession.count_active(user=user) == 2
+        assert SearchSession.count_active(session_id="anonymous") == 1
+        # a search older than the job timeout cannot be running anymore
+        with override_settings(SEARCH_JOB_TIMEOUT=-1):
+            assert SearchSession.count_active(user=user) == 0
+
+    @override_settings(SEARCH_MAX_ACTIVE_PER_USER=1)
+    def test_create_capped(self):
+        from unittest import mock
+        from rest_framework.test import APIClient
+
+        data = {"search_term": "akt1", "fc_cutoff": 0.6, "p_value_cutoff": 1.31, "search_mode": "gene", "analysis_groups": []}
+        client = APIClient()
+        with mock.patch("cb.viewsets.start_search_session.delay") as delay:
+            assert client.post("/api/search/", {**data, "session_id": "anonymous"}, format="json", secure=True).status_code == 201
+            assert client.post("/api/search/", {**data, "session_id": "anonymous"}, format="json", secure=True).status_code == 429
+            # anonymous searches without a session id are not counted against each other
+            for _ in range(2):
+                assert client.post("/api/search/", data, format="json", secure=True).status_code == 201
+        assert delay.call_count == 3
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+                   WEBSOCKET_TOKEN_LOCAL_TIMEOUT=0)
+class TestTokenAuthMiddleware(TestCase):
+    def test_get_user(self):
+        from rest_framework.authtoken.models import Token
+        from cinderBackend.authentication import get_user, get_token_key, resolve_user, local_token_users
+
+        cache.clear()
+        local_token_users.clear()
+        user = User.objects.create_user(username="socket", password="socket")
+        token = Token.objects.get(user=user)
+        assert get_token_key(b"a=1&token=" + token.key.encode() + b"&b") == token.key
+        assert get_token_key(b"token") is None and get_token_key(b"") is None
+        assert resolve_user(token.key) == user
+        # the shared cache holds only the user id and a hit loads the user by its primary key
+        assert cache.get(f"token_user_{token.key}") == user.pk
+        with self.assertNumQueries(1):
+            assert resolve_user(token.key) == user
+        # the process keeps the user in memory even without the shared cache
+        with override_settings(WEBSOCKET_TOKEN_LOCAL_TIMEOUT=60):
+            resolve_user(token.key)
+        cache.clear()
+        with self.assertNumQueries(0):
+            assert async_to_sync(get_user)(token.key) == user
+
+        # a rotated token is removed from the shared cache
+        local_token_users.clear()
+        resolve_user(token.key)
+        token.delete()
+        assert resolve_user(token.key).is_anonymous
+        assert resolve_user("missing").is_anonymous
+
+
+class TestColumns(SimpleTestCase):
+    def test_compute_columns(self):
+        content = b"id\tvalue\tname\n1\t1.5\ta\n2\t\tb\n3\tNaN\t\"c\"\n"
+        text, numeric = compute_columns(io.BytesIO(content), "\t", 3)
+        assert text.column_names == ["id", "value", "name"]
+        assert text.column("name").to_pylist() == ["a", "b", "c"]
+        assert numeric.column_names == ["id", "value"]
+        assert numeric.column("value").to_pylist()[0] == 1.5
+
+    def test_compute_columns_ragged_rows(self):
+        content = b"id,value\n1,2,3\n\n4\n"
+        text, numeric = compute_columns(io.BytesIO(content), ",", 3)
+        assert text.column("id").to_pylist() == ["1", "", "4"]
+        assert text.column("value").to_pylist() == ["2", "", ""]
+
+    def test_compute_columns_django_file(self):
+        from django.core.files import File
+
+        text, numeric = compute_columns(File(io.BytesIO(b"id,value\n1,2,3\n\n4\n")), ",", 3)
+        assert text.num_rows == 3
+        assert text.column("id").to_pylist() == ["1", "", "4"]
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_write_columns_in_batches(self):
+        from unittest import mock
+        from cb import file_index
+
+        rows = "".join(f"P{i}\t{i / 2}\t{'x' if i == 250 else i}\n" for i in range(300))
+        for content in [f"id\tvalue\tmixed\n{rows}", f"id\tvalue\tmixed\n{rows}a\tb\tc\td\n"]:
+            row_count = content.count("\n") - 1
+            with mock.patch.object(file_index, "COLUMN_BATCH_ROWS", 64), mock.patch.object(file_index, "COLUMN_BLOCK_SIZE", 256):
+                file_index.write_columns("batches", io.BytesIO(content.encode()), "\t", row_count)
+            reader = pa.ipc.open_file(pa.memory_map(os.path.join(artifact_dir("batches"), file_index.COLUMNS_FILE)))
+            assert reader.num_record_batches > 1
+            text, numeric = file_index.load_columns("batches")
+            assert text.num_rows == row_count
+            assert text.column("id").to_pylist()[:2] == ["P0", "P1"]
+            assert numeric.column_names == (["value"] if row_count == 300 else [])
+            if row_count == 300:
+                assert numeric.column("value").to_pylist()[299] == 149.5
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_concurrent_writes(self):
+        from cb import file_index
+
+        content = "id\tvalue\n" + "".join(f"P{i}\t{i}\n" for i in range(2000))
+        offsets = compute_row_offsets(io.BytesIO(content.encode()))
+
+        def build(_):
+            file_index.write_columns("shared", io.BytesIO(content.encode()), "\t", 2000)
+            file_index.save_row_offsets("shared", offsets)
+            file_index.save_vocabulary("shared", "id", [f"p{i}" for i in range(2000)])
+
+        # every writer has its own temporary files so builds of the same hash do not corrupt each other
+        run_tasks(build, range(4), workers=4)
+        text, numeric = file_index.load_columns("shared")
+        assert text.num_rows == 2000 and numeric.column("value").to_pylist()[-1] == 1999
+        assert list(file_index.load_row_offsets("shared")) == list(offsets)
+        assert len(load_vocabulary("shared", "id")) == 2000
+        assert not [name for name in os.listdir(artifact_dir("shared")) if name.endswith(".tmp")]
+        assert file_index.temp_path(os.path.join(artifact_dir("shared"), "columns.arrow")) != \
+            file_index.temp_path(os.path.join(artifact_dir("shared"), "columns.arrow"))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestProjectFileColumns(TestCase):
+    def test_read_columns(self):
+        file = create_identifier_file()
+        file.save_altered()
+        assert file.get_column_names() == ["Protein.Group", "Genes", "Log2FC", "Log10P"]
+        assert file.read_columns(["Genes", "Missing"], [4, 2]) == {"Genes": ["TP53", "MAPK3"]}
+        values = file.read_numeric_columns(["Log2FC", "Genes"])
+        assert list(values["Log2FC"]) == [1.5, -2, 0.1]
+        assert all(v != v for v in values["Genes"])
 
+    def test_column_views_do_not_build(self):
+        from unittest import mock
+        from rest_framework.test import APIClient
+        from cb import file_index
 
+        file = create_identifier_file()
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="viewer", password="viewer"))
+        # a file that has not been hashed yet only has its header line or the requested column read
+        with mock.patch.object(file_index, "write_columns", side_effect=AssertionError("built in the request")), \
+                mock.patch.object(file_index, "compute_columns", side_effect=AssertionError("built in the request")), \
+                mock.patch.object(file_index, "compute_row_offsets", side_effect=AssertionError("built in the request")):
+            response = client.get(f"/api/project_files/{file.id}/get_columns/", secure=True)
+            assert response.status_code == 200 and response.data == ["Protein.Group", "Genes", "Log2FC", "Log10P"]
+            response = client.get(f"/api/project_files/{file.id}/get_unique_comparison_label/", {"column": "Genes"}, secure=True)
+            assert response.status_code == 200 and response.data == ["MAPK3", "AKT1;AKT2", "TP53"]
+            response = client.get(f"/api/project_files/{file.id}/get_unique_comparison_label/", {"column": "Missing"}, secure=True)
+            assert response.status_code == 400
+        # once the column store is built the labels are read from it
+        file.save_altered()
+        with mock.patch.object(file_index, "unique_column_values", side_effect=AssertionError("file read again")):
+            response = client.get(f"/api/project_files/{file.id}/get_unique_comparison_label/", {"column": "Genes"}, secure=True)
+        assert response.status_code == 200 and response.data == ["MAPK3", "AKT1;AKT2", "TP53"]
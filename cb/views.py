@@ -1,9 +1,11 @@
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 from django.conf import settings
+from django.core.cache import cache
 from django.http import JsonResponse
 from django.shortcuts import render
 from django.views.decorators.csrf import ensure_csrf_cookie
+from drf_chunked_upload import settings as chunked_upload_settings
 from drf_chunked_upload.exceptions import ChunkedUploadError
 from drf_chunked_upload.views import ChunkedUploadView
 from rest_framework import status
@@ -14,12 +16,22 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from cb.models import upload_checksum_cache_key
+
 
 # Create your views here.
 class DataChunkedUploadView(ChunkedUploadView):
     permission_classes = [IsAuthenticated]
     parser_classes = (MultiPartParser,)
 
+    def on_completion(self, chunked_upload, request):
+        # keep the sha256 verified against the client so that binding the upload does not hash the file again
+        checksum = getattr(chunked_upload, "_checksum", None)
+        if checksum and chunked_upload_settings.CHECKSUM_TYPE == "sha256":
+            cache.set(upload_checksum_cache_key(chunked_upload.id), checksum,
+                      int(chunked_upload_settings.EXPIRATION_DELTA.total_seconds()))
+        return super().on_completion(chunked_upload, request)
+
     def _put_chunk(self, request, pk=None, whole=False, *args, **kwargs):
         try:
             chunk = request.data[self.field_name]
@@ -104,9 +116,6 @@ class DataChunkedUploadView(ChunkedUploadView):
 
         return chunked_upload
 
-    def on_completion(self, chunked_upload, request):
-        return super().on_completion(chunked_upload, request)
-
 
 class LogoutView(APIView):
     permission_classes = [IsAuthenticated]
@@ -1,12 +1,11 @@
-import csv
 import json
 import re
 import uuid
 
-import pandas as pd
 import requests
 from allauth.socialaccount.models import SocialAccount, SocialToken, SocialApp
 from django.contrib.auth import logout
+from django.core.cache import cache
 from django.core.signing import TimestampSigner, SignatureExpired, BadSignature
 from django.db import transaction
 from django.db.models import Q, Max
@@ -28,12 +27,12 @@ from sdrf_pipelines.sdrf.sdrf import SdrfDataFrame
 
 from cb.filters import UnimodFilter
 from cb.rq_tasks import start_search_session, load_curtain_data, compose_analysis_group_from_curtain_data, \
-    export_search_data, export_sdrf_task, validate_sdrf_file, process_imported_metadata_file
+    export_search_data, export_sdrf_task, validate_sdrf_file, process_imported_metadata_file, process_project_file
 from django.conf import settings
 
 from cb.models import Project, AnalysisGroup, ProjectFile, ComparisonMatrix, SampleAnnotation, SearchResult, \
     SearchSession, Species, CurtainData, Abs, Collate, CollateTag, LabGroup, SourceFile, MetadataColumn, \
-    SubcellularLocation, Tissue, HumanDisease, MSUniqueVocabularies, Unimod, UserProfile
+    SubcellularLocation, Tissue, HumanDisease, MSUniqueVocabularies, Unimod, UserProfile, upload_checksum_cache_key
 from cb.serializers import ProjectSerializer, AnalysisGroupSerializer, ProjectFileSerializer, \
     ComparisonMatrixSerializer, SampleAnnotationSerializer, SearchResultSerializer, SearchSessionSerializer, \
     SpeciesSerializer, CurtainDataSerializer, CollateSerializers, CollateTagSerializer, UserSerializer, \
@@ -381,18 +380,21 @@ class ProjectFileViewSet(viewsets.ModelViewSet, FilterMixin):
 
     def update(self, request, *args, **kwargs):
         project_file = self.get_object()
-        if 'name' in request.data:
-            project_file.name = request.data['name']
-        if 'description' in request.data:
-            project_file.description = request.data['description']
-        if 'file_type' in request.data:
-            project_file.file_type = request.data['file_type']
-        if 'file_category' in request.data:
-            project_file.file_category = request.data['file_category']
+        update_fields = ["updated_at"]
+        for field in ['name', 'description', 'file_type', 'file_category']:
+            if field in request.data:
+                setattr(project_file, field, request.data[field])
+                update_fields.append(field)
         if 'extra_data' in request.data:
             project_file.extra_data = json.dumps(request.data['extra_data'])
+            # the identifier index depends on the columns set in extra_data, it is rebuilt by the worker
+            project_file.identifier_indexed = False
+            update_fields += ['extra_data', 'identifier_indexed']
 
-        project_file.save()
+        # only the edited fields are written so that the file, hash and index state set by a running ingest job are kept
+        project_file.save(update_fields=update_fields)
+        if 'extra_data' in request.data:
+            project_file.queue_processing(request.data.get('session_id', None))
         return Response(ProjectFileSerializer(project_file).data, status=status.HTTP_200_OK)
 
     def destroy(self, request, *args, **kwargs):
@@ -409,8 +411,7 @@ class ProjectFileViewSet(viewsets.ModelViewSet, FilterMixin):
         file_name = request.data['file_name']
         file_type = request.data['file_type']
         file_category = request.data['file_category']
-        exist_file = analysis_group.project_files.all().filter(file_category=file_category)
-        if exist_file.exists():
+        for exist_file in analysis_group.project_files.all().filter(file_category=file_category):
             exist_file.delete()
 
         upload = ChunkedUpload.objects.get(id=upload_id)
@@ -419,21 +420,22 @@ class ProjectFileViewSet(viewsets.ModelViewSet, FilterMixin):
         project_file.file_type = file_type
         project_file.file_category = file_category
         project_file.analysis_group = analysis_group
-        with open(upload.file.path, 'rb') as f:
-            project_file.file.save(upload.filename, f)
+        # the completed upload is linked or moved into place instead of being copied and the sha256 verified when the
+        # upload completed is reused instead of hashing the file again
+        linked = project_file.link_file(upload.file.path, upload.filename)
+        file_hash = cache.get(upload_checksum_cache_key(upload.id))
         project_file.load_file_content = True
-        project_file.save_altered()
-        upload.delete()
+        project_file.index_status = "pending"
+        project_file.save()
+        upload.delete(delete_file=linked)
+        # hashing and indexing run in the worker, the file is searchable once index_status is ready
+        process_project_file.delay(project_file.id, request.data.get('session_id', None), file_hash)
         return Response(ProjectFileSerializer(project_file).data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['get'])
     def get_columns(self, request, pk=None):
         project_file = self.get_object()
-        with project_file.file.open("rt") as f:
-            line = f.readline()
-            delimiter = project_file.get_delimiter()
-            headers = next(csv.reader([line.rstrip()], delimiter=delimiter, quotechar='"'))
-            return Response(headers, status=status.HTTP_200_OK)
+        return Response(project_file.get_column_names(), status=status.HTTP_200_OK)
 
 
     @action(detail=True, methods=['get'])
@@ -456,11 +458,11 @@ class ProjectFileViewSet(viewsets.ModelViewSet, FilterMixin):
         column = request.query_params.get('column', None)
         if not column:
             return Response(status=status.HTTP_400_BAD_REQUEST)
-        with file.file.open("rt") as f:
-            data = pd.read_csv(f, sep=None)
-            labels = data[column].unique()
-            labels = labels[~pd.isnull(labels)]
-        return Response(list(labels), status=status.HTTP_200_OK)
+        # labels are read from the column store when it exists, the request never builds it
+        labels = file.get_unique_values(column)
+        if labels is None:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        return Response(labels, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['get'])
     def request_download_token(self, request, pk=None):
@@ -663,6 +665,15 @@ class SearchSessionViewSet(viewsets.ModelViewSet, FilterMixin):
         search_mode = request.data['search_mode']
         analysis_groups = request.data['analysis_groups']
         user = self.request.user
+        # anonymous searches without a websocket session cannot be told apart so they are not capped
+        if settings.SEARCH_MAX_ACTIVE_PER_USER and (user.is_authenticated or request.data.get('session_id')):
+            if user.is_authenticated:
+                active = SearchSession.count_active(user=user)
+            else:
+                active = SearchSession.count_active(session_id=request.data['session_id'])
+            if active >= settings.SEARCH_MAX_ACTIVE_PER_USER:
+                return Response({'detail': 'Too many searches are running, wait for one to finish or cancel it.'},
+                                status=status.HTTP_429_TOO_MANY_REQUESTS)
         if 'session_id' in request.data:
             session_id = request.data['session_id']
             search_session = SearchSession.objects.create(search_term=search_term, session_id=session_id)
@@ -678,6 +689,7 @@ class SearchSessionViewSet(viewsets.ModelViewSet, FilterMixin):
         search_session.log2_fc = float(fc_cutoff)
         search_session.log10_p_value = float(p_value_cutoff)
         search_session.search_mode = search_mode
+        search_session.match_type = request.data.get('match_type', 'exact')
         # check if user is not anonymous
         if user.is_authenticated:
             search_session.user = user
@@ -708,6 +720,17 @@ class SearchSessionViewSet(viewsets.ModelViewSet, FilterMixin):
         search_session.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        search_session = self.get_object()
+        if search_session.user:
+            if search_session.user != self.request.user:
+                return Response(status=status.HTTP_403_FORBIDDEN)
+        elif not search_session.session_id or request.data.get('session_id') != search_session.session_id:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        search_session.cancel()
+        return Response(SearchSessionSerializer(search_session).data, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=['post'])
     def get_analysis_groups_from_projects(self, request):
         project_ids = request.data['projects']
@@ -1,24 +1,74 @@
+import time
+from urllib.parse import parse_qs
+
 from channels.auth import AuthMiddlewareStack
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import AnonymousUser
 
-@database_sync_to_async
-def get_user(token):
-    try:
-        return Token.objects.get(key=token).user
-    except Token.DoesNotExist:
-        return AnonymousUser()
+from cb.models import token_user_cache_key
+
+# token key to (expiry, user) of the tokens resolved recently by this process
+local_token_users = {}
+
+
+def get_local_user(token):
+    entry = local_token_users.get(token)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+
+def set_local_user(token, user):
+    now = time.monotonic()
+    if len(local_token_users) >= settings.WEBSOCKET_TOKEN_LOCAL_LIMIT:
+        for key in [k for k, v in local_token_users.items() if v[0] <= now]:
+            del local_token_users[key]
+        if len(local_token_users) >= settings.WEBSOCKET_TOKEN_LOCAL_LIMIT:
+            local_token_users.clear()
+    local_token_users[token] = (now + settings.WEBSOCKET_TOKEN_LOCAL_TIMEOUT, user)
+
+
+def resolve_user(token):
+    """
+    Return the user of a token, the shared cache only holds the user id so the user is loaded by its primary key. The
+    token is looked up in the database when it is not cached, unknown tokens are not cached
+    """
+    user_id = cache.get(token_user_cache_key(token))
+    user = None
+    if user_id is not None:
+        user = get_user_model().objects.filter(pk=user_id).first()
+    if user is None:
+        token_object = Token.objects.select_related("user").filter(key=token).first()
+        if token_object is None:
+            return AnonymousUser()
+        user = token_object.user
+        cache.set(token_user_cache_key(token), user.pk, settings.WEBSOCKET_TOKEN_CACHE_TIMEOUT)
+    set_local_user(token, user)
+    return user
+
+
+async def get_user(token):
+    # users resolved by this process within a few seconds are returned without a thread from the pool
+    user = get_local_user(token)
+    if user is not None:
+        return user
+    return await database_sync_to_async(resolve_user)(token)
+
+
+def get_token_key(query_string: bytes):
+    return parse_qs(query_string.decode(errors="replace")).get("token", [None])[0]
+
 
 class TokenAuthMiddleware(BaseMiddleware):
     def __init__(self, inner):
         super().__init__(inner)
 
     async def __call__(self, scope, receive, send):
-        try:
-            token_key = (dict((x.split('=') for x in scope['query_string'].decode().split("&")))).get('token', None)
-        except ValueError:
-            token_key = None
+        token_key = get_token_key(scope.get('query_string', b''))
         scope['user'] = AnonymousUser() if token_key is None else await get_user(token_key)
         return await super().__call__(scope, receive, send)
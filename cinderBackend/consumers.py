@@ -1,67 +1,121 @@
+import time
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
 
+from cb.models import SearchSession
+from cb.progress import get_progress_snapshots
 
-class SearchConsumer(AsyncJsonWebsocketConsumer):
-    async def connect(self):
-        self.session_id = self.scope['url_route']['kwargs']['session_id']
 
-        await self.channel_layer.group_add(
-            "search_" + self.session_id,
-            self.channel_name
-        )
+def cancel_search_session(search_session_id, session_id) -> bool:
+    """
+    Cancel a search started from the same websocket session, returns False if there is no such search
+    """
+    search_session = SearchSession.objects.filter(id=search_session_id, session_id=session_id).first()
+    if not search_session:
+        return False
+    search_session.cancel()
+    return True
 
-        await self.accept()
-        await self.send_json({
-            "message": {"type": "notification", "content": "Connected to search session."}
-        })
 
-    async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            "search_" + self.session_id,
-            self.channel_name
-        )
+class CommandRateLimiter:
+    """
+    Token bucket of a websocket connection, allow returns False once the connection sends commands faster than rate per
+    second for longer than burst commands
+    """
 
-    async def receive_json(self, content, **kwargs):
-        await self.channel_layer.group_send(
-            "search_" + self.session_id,
-            {
-                "type": "search_message",
-                "message": content
-            }
-        )
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
 
-    async def search_message(self, event):
-        message = event['message']
-        await self.send_json(message)
+    def allow(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
 
 
-class CurtainConsumer(AsyncJsonWebsocketConsumer):
+class SessionConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Websocket of a client session. The connection joins the f"{prefix}_{session_id}" group that the jobs of the session
+    publish to. Messages from the client are never sent to the group, only the commands in the commands dictionary of
+    the consumer are handled, for the client that sent them, and anything else or any command over the rate limit of
+    the connection is dropped.
+    """
+    prefix = None
+    commands = {
+        "subscribe": "subscribe",
+        "unsubscribe": "unsubscribe",
+        "request_snapshot": "request_snapshot",
+    }
+
     async def connect(self):
         self.session_id = self.scope['url_route']['kwargs']['session_id']
-        await self.channel_layer.group_add(
-            "curtain_" + self.session_id,
-            self.channel_name
-        )
+        self.group_name = f"{self.prefix}_{self.session_id}"
+        self.rate_limiter = CommandRateLimiter(settings.WEBSOCKET_COMMAND_RATE, settings.WEBSOCKET_COMMAND_BURST)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        self.subscribed = True
         await self.accept()
         await self.send_json({
-            "message": {"type": "notification", "content": "Connected to curtain session."}
+            "message": {"type": "notification", "content": f"Connected to {self.prefix} session."}
         })
+        # jobs of the session that ran or are running are sent their latest state so the client does not have to poll
+        await self.request_snapshot({})
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            "curtain_" + self.session_id,
-            self.channel_name
-        )
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
     async def receive_json(self, content, **kwargs):
-        await self.channel_layer.group_send(
-            "curtain_" + self.session_id,
-            {
-                "type": "curtain_message",
-                "message": content
-            }
-        )
+        if not isinstance(content, dict) or content.get("type") not in self.commands:
+            return
+        if not self.rate_limiter.allow():
+            return
+        await getattr(self, self.commands[content["type"]])(content)
+
+    async def subscribe(self, content):
+        if not self.subscribed:
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
+            self.subscribed = True
+            await self.request_snapshot(content)
+
+    async def unsubscribe(self, content):
+        if self.subscribed:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            self.subscribed = False
+
+    async def request_snapshot(self, content):
+        for message in await sync_to_async(get_progress_snapshots)(self.group_name):
+            await self.send_json(message)
+
+
+class SearchConsumer(SessionConsumer):
+    prefix = "search"
+    commands = {
+        **SessionConsumer.commands,
+        "cancel_search": "cancel_search",
+    }
+
+    async def cancel_search(self, content):
+        cancelled = await database_sync_to_async(cancel_search_session)(content.get("id"), self.session_id)
+        await self.send_json({
+            "type": "search_status", "status": "cancelling" if cancelled else "not_found", "id": content.get("id")
+        })
+
+    async def search_message(self, event):
+        message = event['message']
+        await self.send_json(message)
+
+
+class CurtainConsumer(SessionConsumer):
+    prefix = "curtain"
 
     async def curtain_message(self, event):
         message = event['message']
-        await self.send_json(message)
\ No newline at end of file
+        await self.send_json(message)
@@ -264,14 +264,16 @@ CHANNEL_LAYERS = {
 }
 
 # Django-RQ settings
+# searches, file and Curtain ingestion, exports and SDRF validation run on their own queues so that interactive searches
+# are never queued behind bulk work, see the worker services in docker-compose.yml
 RQ_QUEUES = {
-    'default': {
+    name: {
         'HOST': REDIS_HOST,
         'PORT': REDIS_PORT,
         'DB': REDIS_DB,
         'PASSWORD': REDIS_PASSWORD,
         'DEFAULT_TIMEOUT': 3600,
-    },
+    } for name in ['default', 'search', 'ingest', 'export', 'validation']
 }
 
 # Storage settings
@@ -297,6 +299,48 @@ DRF_CHUNKED_UPLOAD_CHECKSUM = 'sha256'
 # CURTAIN settings
 CURTAIN_HOST = os.environ.get("CURTAIN_HOST", "https://celsus.muttsu.xyz")
 
+# Search settings
+# number of threads used by a search job to read the matched and related files
+SEARCH_WORKERS = int(os.environ.get("SEARCH_WORKERS", min(4, os.cpu_count() or 1)))
+# number of search results written per insert, results are written as each analysis group finishes
+SEARCH_RESULT_BATCH_SIZE = int(os.environ.get("SEARCH_RESULT_BATCH_SIZE", "1000"))
+# seconds a completed search stays reusable by an identical search over unchanged files
+SEARCH_RESULT_CACHE_TIMEOUT = int(os.environ.get("SEARCH_RESULT_CACHE_TIMEOUT", 60 * 60 * 24 * 7))
+# minimum trigram similarity between a term and an identifier for the fuzzy match type, the pg_trgm default
+SEARCH_FUZZY_THRESHOLD = float(os.environ.get("SEARCH_FUZZY_THRESHOLD", "0.3"))
+# false positive rate the identifier bloom filter of every file is sized for
+SEARCH_BLOOM_FALSE_POSITIVE_RATE = float(os.environ.get("SEARCH_BLOOM_FALSE_POSITIVE_RATE", "0.01"))
+# maximum estimated work of a search in rows read, the remaining analysis groups are skipped and the results flagged as
+# partial once it is reached. 0 disables the budget.
+SEARCH_WORK_BUDGET = int(os.environ.get("SEARCH_WORK_BUDGET", "0"))
+# seconds a search job may run before the worker stops it
+SEARCH_JOB_TIMEOUT = int(os.environ.get("SEARCH_JOB_TIMEOUT", 60 * 60 * 3))
+# searches a user, or an anonymous websocket session, may have queued or running at once. 0 disables the cap.
+SEARCH_MAX_ACTIVE_PER_USER = int(os.environ.get("SEARCH_MAX_ACTIVE_PER_USER", "2"))
+
+# Progress settings
+# progress updates of a job published per second at most, updates in between are coalesced
+PROGRESS_MAX_RATE = float(os.environ.get("PROGRESS_MAX_RATE", "2"))
+# a progress update that moves the percentage by at least this much is published even when it is over the rate
+PROGRESS_STEP = float(os.environ.get("PROGRESS_STEP", "5"))
+# seconds the latest message of a job is kept for websocket clients that connect while or after it runs
+PROGRESS_SNAPSHOT_TIMEOUT = int(os.environ.get("PROGRESS_SNAPSHOT_TIMEOUT", "3600"))
+# jobs of a websocket session with a kept message at most, the oldest are dropped first
+PROGRESS_SNAPSHOT_LIMIT = int(os.environ.get("PROGRESS_SNAPSHOT_LIMIT", "20"))
+
+# Websocket settings
+# commands a websocket connection may send per second on average, commands over the limit are dropped
+WEBSOCKET_COMMAND_RATE = float(os.environ.get("WEBSOCKET_COMMAND_RATE", "5"))
+# commands a websocket connection may send at once before the rate applies
+WEBSOCKET_COMMAND_BURST = int(os.environ.get("WEBSOCKET_COMMAND_BURST", "10"))
+# seconds the user of a websocket auth token is kept in the cache, entries are removed when the token or user changes
+WEBSOCKET_TOKEN_CACHE_TIMEOUT = int(os.environ.get("WEBSOCKET_TOKEN_CACHE_TIMEOUT", "300"))
+# seconds the user of a websocket auth token is kept in the memory of the process in front of the cache, removals in
+# other processes are only seen once it expires so it is kept short
+WEBSOCKET_TOKEN_LOCAL_TIMEOUT = int(os.environ.get("WEBSOCKET_TOKEN_LOCAL_TIMEOUT", "5"))
+# auth tokens kept in the memory of a process at most
+WEBSOCKET_TOKEN_LOCAL_LIMIT = int(os.environ.get("WEBSOCKET_TOKEN_LOCAL_LIMIT", "1024"))
+
 # FRONTEND settings
 FRONTEND_FOOTER = os.environ.get("FRONTEND_FOOTER", "MRC-PPU, University of Dundee. ASAP.")
 